@@ -0,0 +1,128 @@
+"""Ingest admission control for ``/api/golf_stats``.
+
+Devices that boot together report on the same fixed interval and hit the
+server in synchronized bursts. ``AdmissionController`` flattens those bursts:
+
+- a token bucket per device limits how often one device may report,
+- a global cap limits how many ingest writes run at the same time,
+- every response carries a jittered ``next_report_in`` so device agents
+  drift apart instead of staying in lockstep.
+
+Rejected requests get ``429`` with a ``Retry-After`` (seconds). Limits are
+per server process.
+"""
+import math
+import os
+import random
+import threading
+import time
+
+
+class TokenBucket:
+    """Classic token bucket: ``capacity`` tokens, one token every ``refill_seconds``."""
+
+    __slots__ = ('capacity', 'refill_seconds', 'tokens', 'updated_at')
+
+    def __init__(self, capacity, refill_seconds, now):
+        self.capacity = capacity
+        self.refill_seconds = refill_seconds
+        self.tokens = float(capacity)
+        self.updated_at = now
+
+    def _refill(self, now):
+        elapsed = now - self.updated_at
+        if elapsed > 0:
+            self.tokens = min(self.capacity, self.tokens + elapsed / self.refill_seconds)
+            self.updated_at = now
+
+    def take(self, now):
+        """Take one token. Returns 0 on success, else seconds until one is available."""
+        self._refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) * self.refill_seconds
+
+    def is_full(self, now):
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+
+class AdmissionController:
+    SWEEP_INTERVAL_SECONDS = 600
+
+    def __init__(self, device_burst=5, device_refill_seconds=60, max_concurrent=8,
+                 report_interval=900, report_jitter=0.2, clock=time.monotonic):
+        self.device_burst = device_burst
+        self.device_refill_seconds = device_refill_seconds
+        self.max_concurrent = max_concurrent
+        self.report_interval = report_interval
+        self.report_jitter = report_jitter
+        self._clock = clock
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_concurrent)
+        self._last_sweep = clock()
+
+    @classmethod
+    def from_env(cls, **overrides):
+        """Build a controller from the ``GOLF_INGEST_*`` / ``GOLF_REPORT_*`` environment variables.
+
+        Keyword arguments take precedence over the environment.
+        """
+        settings = dict(
+            device_burst=int(os.environ.get('GOLF_INGEST_DEVICE_BURST', 5)),
+            device_refill_seconds=float(os.environ.get('GOLF_INGEST_DEVICE_REFILL_SECONDS', 60)),
+            max_concurrent=int(os.environ.get('GOLF_INGEST_MAX_CONCURRENT', 8)),
+            report_interval=int(os.environ.get('GOLF_REPORT_INTERVAL_SECONDS', 900)),
+            report_jitter=float(os.environ.get('GOLF_REPORT_JITTER', 0.2)),
+        )
+        settings.update(overrides)
+        return cls(**settings)
+
+    # ---------- per-device token buckets ----------
+
+    def check_device(self, device_id):
+        """Spend one of the device's tokens. Returns 0 if admitted, else Retry-After seconds."""
+        now = self._clock()
+        with self._lock:
+            bucket = self._buckets.get(device_id)
+            if bucket is None:
+                bucket = self._buckets[device_id] = TokenBucket(self.device_burst, self.device_refill_seconds, now)
+            wait = bucket.take(now)
+            self._sweep(now)
+        return self._jittered_retry_after(wait) if wait else 0
+
+    def _sweep(self, now):
+        """Drop buckets that have refilled completely, they carry no state."""
+        if now - self._last_sweep < self.SWEEP_INTERVAL_SECONDS:
+            return
+        self._last_sweep = now
+        for device_id in [d for d, b in self._buckets.items() if b.is_full(now)]:
+            del self._buckets[device_id]
+
+    # ---------- global concurrency cap ----------
+
+    def acquire_slot(self):
+        """Reserve one of the concurrent ingest slots without blocking."""
+        return self._slots.acquire(blocking=False)
+
+    def release_slot(self):
+        self._slots.release()
+
+    def busy_retry_after(self):
+        """Retry-After for a request rejected by the concurrency cap."""
+        return self._jittered_retry_after(1, spread=5)
+
+    # ---------- report pacing ----------
+
+    def next_report_interval(self):
+        """Suggested seconds until the device's next report, spread by +/- ``report_jitter``."""
+        spread = self.report_interval * self.report_jitter
+        return max(1, int(round(self.report_interval + random.uniform(-spread, spread))))
+
+    @staticmethod
+    def _jittered_retry_after(wait, spread=None):
+        """Whole seconds (Retry-After has no fractions) plus jitter so rejected clients don't retry together."""
+        spread = max(1, wait) if spread is None else spread
+        return max(1, math.ceil(wait + random.uniform(0, spread)))
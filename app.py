@@ -1,40 +1,52 @@
 from flask import Flask, request, jsonify, render_template
-from datetime import datetime
-import sqlite3
+from datetime import date, datetime
 import os
 import json
+import hashlib
+
+from admission import AdmissionController
+from ingest import parse_golf_stats
+from snapshot import ReadSnapshot
+from storage import PERIODS, open_storage, period_bounds, period_key
 
 app = Flask(__name__)
 
+# Storage backend (single file or monthly shards), see storage.py
+storage = open_storage()
+
+# Dashboard/analytics reads are served from an in-memory snapshot (see snapshot.py);
+# GOLF_SNAPSHOT_INTERVAL_SECONDS=0 disables it and reads go straight to storage
+SNAPSHOT_INTERVAL_SECONDS = float(os.environ.get('GOLF_SNAPSHOT_INTERVAL_SECONDS', 10))
+SNAPSHOT_REFRESH_WRITES = int(os.environ.get('GOLF_SNAPSHOT_REFRESH_WRITES', 100))
+if SNAPSHOT_INTERVAL_SECONDS > 0:
+    reads = ReadSnapshot(storage, SNAPSHOT_INTERVAL_SECONDS, SNAPSHOT_REFRESH_WRITES)
+else:
+    reads = storage
+
+# Ingest admission control (per-device token buckets + concurrency cap), see admission.py
+admission = AdmissionController.from_env()
+
 # Database initialization
 def init_db():
-    conn = sqlite3.connect('data/golf_stats.db')
-    c = conn.cursor()
-    
-    # Create tables
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS devices (
-            device_id TEXT PRIMARY KEY,
-            device_name TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS daily_stats (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            device_id TEXT,
-            date TEXT,
-            hit_count INTEGER,
-            firmware_version TEXT DEFAULT 'unknown',
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (device_id) REFERENCES devices (device_id),
-            UNIQUE(device_id, date, firmware_version)
-        )
-    ''')
-    
-    conn.commit()
-    conn.close()
+    storage.init_schema()
+
+def read_response(payload):
+    """JSON response for snapshot-backed reads, with the snapshot's staleness headers."""
+    response = jsonify(payload)
+    if isinstance(reads, ReadSnapshot):
+        response.headers.update(reads.staleness_headers())
+    return response
+
+def refresh_reads():
+    """Make admin changes (rename/delete) visible right away instead of after the next refresh."""
+    if isinstance(reads, ReadSnapshot):
+        reads.refresh()
+
+def too_many_requests(retry_after):
+    """429 response; the device agent retries after ``retry_after`` seconds."""
+    response = jsonify({'error': 'Too many requests', 'retry_after': retry_after, 'next_report_in': retry_after})
+    response.headers['Retry-After'] = str(retry_after)
+    return response, 429
 
 # API endpoint to receive golf stats
 @app.route('/api/golf_stats', methods=['POST'])
@@ -42,34 +54,28 @@ def receive_golf_stats():
     try:
         data = request.get_json()
         
-        if not data or 'device_id' not in data or 'daily_data' not in data:
-            return jsonify({'error': 'Invalid data format'}), 400
+        try:
+            ingest = parse_golf_stats(data)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         
-        device_id = data['device_id']
-        daily_data = data['daily_data']
-        firmware_version = data.get('firmware_version', 'unknown')
-
-        conn = sqlite3.connect('data/golf_stats.db')
-        c = conn.cursor()
+        device_id = ingest.device_id
 
-        # Insert or ignore device
-        c.execute('''
-            INSERT OR IGNORE INTO devices (device_id) VALUES (?)
-        ''', (device_id,))
+        if not admission.acquire_slot():
+            return too_many_requests(admission.busy_retry_after())
+        try:
+            retry_after = admission.check_device(device_id)
+            if retry_after:
+                return too_many_requests(retry_after)
 
-        # Insert or update daily stats
-        for date_str, hit_count in daily_data.items():
-            c.execute('''
-                INSERT INTO daily_stats (device_id, date, hit_count, firmware_version)
-                VALUES (?, ?, ?, ?)
-                ON CONFLICT(device_id, date, firmware_version) DO UPDATE SET
-                hit_count = hit_count + excluded.hit_count
-            ''', (device_id, date_str, hit_count, firmware_version))
-        
-        conn.commit()
-        conn.close()
+            # Insert or ignore device, then insert or update daily stats
+            storage.write_ingest(ingest)
+            if isinstance(reads, ReadSnapshot):
+                reads.note_write()
+        finally:
+            admission.release_slot()
         
-        return jsonify({'status': 'success'}), 201
+        return jsonify({'status': 'success', 'next_report_in': admission.next_report_interval()}), 201
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -83,19 +89,7 @@ def dashboard():
 @app.route('/api/dashboard_data')
 def get_dashboard_data():
     try:
-        conn = sqlite3.connect('data/golf_stats.db')
-        c = conn.cursor()
-        
-        query = '''
-            SELECT ds.device_id, ds.date, ds.hit_count, d.created_at, d.device_name, ds.firmware_version
-            FROM daily_stats ds
-            JOIN devices d ON ds.device_id = d.device_id
-            ORDER BY ds.firmware_version, ds.date DESC
-        '''
-        
-        c.execute(query)
-        rows = c.fetchall()
-        conn.close()
+        rows = reads.fetch_dashboard_rows()
         
         # Group data by device, and then by firmware version
         device_data = {}
@@ -116,28 +110,168 @@ def get_dashboard_data():
                 'hit_count': hit_count
             })
         
-        return jsonify(list(device_data.values()))
+        # Per-device version hash so the dashboard can skip devices whose data didn't change
+        for device in device_data.values():
+            payload = json.dumps(device, sort_keys=True, ensure_ascii=False).encode('utf-8')
+            device['version'] = hashlib.sha1(payload).hexdigest()[:16]
+        
+        return read_response(list(device_data.values()))
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-# API endpoint to get all unique firmware versions
+def firmware_summary_dict(row):
+    device_days = row['device_days']
+    return {
+        'firmware_version': row['firmware_version'],
+        'device_count': row['device_count'],
+        'first_date': row['first_date'],
+        'last_date': row['last_date'],
+        'total_hits': row['total_hits'],
+        'device_days': device_days,
+        'hits_per_device_day': round(row['total_hits'] / device_days, 2) if device_days else 0,
+    }
+
+# API endpoint to get all firmware versions with per-version device counts and date spans
 @app.route('/api/firmware_versions')
 def get_firmware_versions():
     try:
-        conn = sqlite3.connect('data/golf_stats.db')
-        c = conn.cursor()
-        
-        c.execute('SELECT DISTINCT firmware_version FROM daily_stats ORDER BY firmware_version DESC')
+        versions = [firmware_summary_dict(row) for row in reads.fetch_firmware_summary()]
         
-        versions = [row[0] for row in c.fetchall()]
-        conn.close()
+        return read_response(versions)
         
-        return jsonify(versions)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+# API endpoint to compare two firmware versions
+@app.route('/api/firmware/compare')
+def compare_firmware():
+    try:
+        version_a = request.args.get('a', '').strip()
+        version_b = request.args.get('b', '').strip()
+        if not version_a or not version_b:
+            return jsonify({'error': 'Query parameters a and b are required'}), 400
+        if version_a == version_b:
+            return jsonify({'error': 'Firmware versions a and b must differ'}), 400
+
+        window_days = request.args.get('window', 14, type=int)
+        if not 1 <= window_days <= 365:
+            return jsonify({'error': 'window must be between 1 and 365 days'}), 400
+
+        summary = {row['firmware_version']: firmware_summary_dict(row)
+                   for row in reads.fetch_firmware_summary([version_a, version_b])}
+        upgrades = reads.fetch_firmware_upgrades(version_a, version_b, window_days)
+
+        devices = []
+        for row in upgrades:
+            before = row['before_hits_per_day']
+            after = row['after_hits_per_day']
+            devices.append({
+                'device_id': row['device_id'],
+                'device_name': row['device_name'] or f'设备 {row["device_id"][-8:].upper()}',
+                'upgraded_on': row['upgraded_on'],
+                'before_days': row['before_days'],
+                'after_days': row['after_days'],
+                'before_hits_per_day': round(before, 2),
+                'after_hits_per_day': round(after, 2),
+                'delta_hits_per_day': round(after - before, 2),
+            })
+
+        # Fleet-level delta is the mean of the per-device deltas, so each upgraded device weighs the same
+        upgrade = {'window_days': window_days, 'device_count': len(devices), 'devices': devices}
+        if devices:
+            before_avg = sum(row['before_hits_per_day'] for row in upgrades) / len(upgrades)
+            after_avg = sum(row['after_hits_per_day'] for row in upgrades) / len(upgrades)
+            upgrade.update({
+                'before_hits_per_day': round(before_avg, 2),
+                'after_hits_per_day': round(after_avg, 2),
+                'delta_hits_per_day': round(after_avg - before_avg, 2),
+                'delta_pct': round((after_avg - before_avg) / before_avg * 100, 1) if before_avg else None,
+            })
+
+        return read_response({
+            'a': summary.get(version_a),
+            'b': summary.get(version_b),
+            'upgrade': upgrade,
+        })
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+# Upper bound for /api/leaderboard?n=
+LEADERBOARD_MAX_N = 100
+
+def period_query_args(default_period=None):
+    """Read and validate ``period`` and ``date`` (default: today) query parameters."""
+    period = request.args.get('period', default_period)
+    if period is not None and period not in PERIODS:
+        raise ValueError(f'period must be one of {", ".join(PERIODS)}')
+    date_str = request.args.get('date') or datetime.now().strftime('%Y-%m-%d')
+    try:
+        date.fromisoformat(date_str)
+    except ValueError:
+        raise ValueError(f'Invalid date: {date_str}')
+    return period, date_str
+
+def period_summary_dict(period, date_str):
+    start, end = period_bounds(period, date_str)
+    row = reads.fetch_period_summary(period, date_str)
+    return {
+        'period': period,
+        'period_key': period_key(period, date_str),
+        'start_date': start,
+        'end_date': end,
+        'active_devices': row['active_devices'],
+        'total_hits': row['total_hits'],
+    }
+
+# API endpoint for hit totals of the day / week / month containing ?date= (all three unless ?period=)
+@app.route('/api/summary')
+def get_summary():
+    try:
+        try:
+            period, date_str = period_query_args()
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        if period:
+            return read_response(period_summary_dict(period, date_str))
+        return read_response({p: period_summary_dict(p, date_str) for p in PERIODS})
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+# API endpoint for the top-n devices of the day / week / month containing ?date=
+@app.route('/api/leaderboard')
+def get_leaderboard():
+    try:
+        try:
+            period, date_str = period_query_args('day')
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        n = request.args.get('n', 10, type=int)
+        if not 1 <= n <= LEADERBOARD_MAX_N:
+            return jsonify({'error': f'n must be between 1 and {LEADERBOARD_MAX_N}'}), 400
+
+        start, end = period_bounds(period, date_str)
+        rows = reads.fetch_leaderboard(period, date_str, n)
+        return read_response({
+            'period': period,
+            'period_key': period_key(period, date_str),
+            'start_date': start,
+            'end_date': end,
+            'leaderboard': [{
+                'rank': i + 1,
+                'device_id': row['device_id'],
+                'device_name': row['device_name'] or f'设备 {row["device_id"][-8:].upper()}',
+                'hit_count': row['hit_count'],
+                'firmware_version': row['firmware_version'],
+            } for i, row in enumerate(rows)],
+        })
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 # API endpoint to rename a device
 @app.route('/api/devices/<device_id>/rename', methods=['PUT'])
 def rename_device(device_id):
@@ -148,19 +282,10 @@ def rename_device(device_id):
         if not new_name or not new_name.strip():
             return jsonify({'error': 'Device name cannot be empty'}), 400
         
-        conn = sqlite3.connect('data/golf_stats.db')
-        c = conn.cursor()
-        
-        # Check if device exists
-        c.execute('SELECT device_id FROM devices WHERE device_id = ?', (device_id,))
-        if not c.fetchone():
-            conn.close()
+        # Update device name (False if the device does not exist)
+        if not storage.rename_device(device_id, new_name.strip()):
             return jsonify({'error': 'Device not found'}), 404
-        
-        # Update device name
-        c.execute('UPDATE devices SET device_name = ? WHERE device_id = ?', (new_name.strip(), device_id))
-        conn.commit()
-        conn.close()
+        refresh_reads()
         
         return jsonify({'status': 'success', 'device_name': new_name.strip()}), 200
         
@@ -171,20 +296,10 @@ def rename_device(device_id):
 @app.route('/api/devices/<device_id>', methods=['DELETE'])
 def delete_device(device_id):
     try:
-        conn = sqlite3.connect('data/golf_stats.db')
-        c = conn.cursor()
-        
-        # Check if device exists
-        c.execute('SELECT device_id FROM devices WHERE device_id = ?', (device_id,))
-        if not c.fetchone():
-            conn.close()
-            return jsonify({'error': 'Device not found'}), 404
-        
         # Delete device and all associated stats (cascade deletion)
-        c.execute('DELETE FROM daily_stats WHERE device_id = ?', (device_id,))
-        c.execute('DELETE FROM devices WHERE device_id = ?', (device_id,))
-        conn.commit()
-        conn.close()
+        if not storage.delete_device(device_id):
+            return jsonify({'error': 'Device not found'}), 404
+        refresh_reads()
         
         return jsonify({'status': 'success'}), 200
         
@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+"""
+历史报告批量回填 (golf.py / waice.py 的 backfill 子命令共用)
+
+整个日期范围只扫描一次数据库，在内存中按周期切分聚合，
+再用进程池并行渲染各周期的报告内容。
+"""
+
+import math
+import os
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime, timedelta
+
+# 报告类型 -> 周期天数 (与 weekly / monthly 子命令保持一致)
+PERIOD_DAYS = {
+    'daily': 1,
+    'weekly': 7,
+    'monthly': 30,
+}
+
+# 周期报告类型 -> (周期名称, 天数)，传给 build_period_report
+PERIOD_NAMES = {
+    'weekly': ("周", 7),
+    'monthly': ("月", 30),
+}
+
+
+def iter_periods(kind: str, start_date: date, end_date: date):
+    """从 start_date 开始按周期切分，生成完整落在范围内的 (开始, 结束) 日期"""
+    days = PERIOD_DAYS[kind]
+    period_start = start_date
+    while period_start + timedelta(days=days - 1) <= end_date:
+        period_end = period_start + timedelta(days=days - 1)
+        yield period_start, period_end
+        period_start = period_end + timedelta(days=1)
+
+
+def _sqlite_round(value):
+    """与 SQLite ROUND(x, 0) 一致的四舍五入 (Python round 是银行家舍入)"""
+    return float(math.floor(value + 0.5)) if value >= 0 else -float(math.floor(-value + 0.5))
+
+
+def aggregate_daily(rows):
+    """单日按设备聚合，与 fetch_leaderboard('day', ...) 的结果一致 (固件版本取最后写入的一条)"""
+    devices = {}
+    for row in sorted(rows, key=lambda row: row['created_at'] or ''):
+        device = devices.get(row['device_id'])
+        if device is None:
+            device = devices[row['device_id']] = {
+                'device_name': row['device_name'],
+                'device_id': row['device_id'],
+                'hit_count': 0,
+            }
+        device['hit_count'] += row['hit_count']
+        device['firmware_version'] = row['firmware_version']
+    return sorted(devices.values(), key=lambda row: row['hit_count'], reverse=True)
+
+
+def aggregate_period(rows):
+    """周期内按设备聚合，与 fetch_period_rows 的结果一致"""
+    devices = {}
+    for row in rows:
+        device = devices.get(row['device_id'])
+        if device is None:
+            device = devices[row['device_id']] = {
+                'device_name': row['device_name'],
+                'device_id': row['device_id'],
+                'total_hits': 0,
+                'dates': set(),
+                'max_daily_hits': row['hit_count'],
+                'row_count': 0,
+            }
+        device['total_hits'] += row['hit_count']
+        device['dates'].add(row['date'])
+        device['max_daily_hits'] = max(device['max_daily_hits'], row['hit_count'])
+        device['row_count'] += 1
+
+    results = []
+    for device in devices.values():
+        results.append({
+            'device_name': device['device_name'],
+            'device_id': device['device_id'],
+            'total_hits': device['total_hits'],
+            'active_days': len(device['dates']),
+            'max_daily_hits': device['max_daily_hits'],
+            'avg_daily_hits': _sqlite_round(device['total_hits'] / device['row_count']),
+        })
+    return sorted(results, key=lambda row: row['total_hits'], reverse=True)
+
+
+def summarize(rows):
+    """周期汇总: 活跃设备数与总击球数，与 fetch_period_summary / fetch_range_summary 一致"""
+    return {
+        'active_devices': len({row['device_id'] for row in rows}),
+        'total_hits': sum(row['hit_count'] for row in rows),
+    }
+
+
+def build_tasks(kind: str, start_date: date, end_date: date, range_rows, limit: int):
+    """把一次范围扫描的结果切分为每个周期的汇总与前 limit 名排行"""
+    rows_by_date = defaultdict(list)
+    for row in range_rows:
+        rows_by_date[row['date']].append(dict(row))
+
+    tasks = []
+    for period_start, period_end in iter_periods(kind, start_date, end_date):
+        rows = []
+        day = period_start
+        while day <= period_end:
+            rows.extend(rows_by_date.get(day.isoformat(), []))
+            day += timedelta(days=1)
+
+        results = aggregate_daily(rows) if kind == 'daily' else aggregate_period(rows)
+        tasks.append((kind, period_start.isoformat(), period_end.isoformat(), summarize(rows), results[:limit]))
+    return tasks
+
+
+def _render(args):
+    build_daily_report, build_period_report, task, now_time = args
+    kind, period_start, period_end, summary, results = task
+    if kind == 'daily':
+        content = build_daily_report(period_start, summary, results, now_time)
+    else:
+        period_name, days = PERIOD_NAMES[kind]
+        content = build_period_report(period_start, period_end, period_name, days, summary, results, now_time)
+    return kind, period_start, period_end, content
+
+
+def render_reports(build_daily_report, build_period_report, tasks, now_time: str, workers=None):
+    """
+    用进程池渲染报告
+    - build_daily_report / build_period_report: 脚本中的模块级报告构建函数 (需能被进程池序列化)
+    返回 [(kind, period_start, period_end, content), ...]，顺序与 tasks 一致
+    """
+    workers = workers or os.cpu_count() or 1
+    jobs = [(build_daily_report, build_period_report, task, now_time) for task in tasks]
+    if workers == 1 or len(jobs) <= 1:
+        return [_render(job) for job in jobs]
+
+    chunksize = max(1, len(jobs) // (workers * 4))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(_render, jobs, chunksize=chunksize))
+
+
+def write_reports(output_dir: str, source: str, reports):
+    """每个周期写一个 Markdown 文件: <source>_<kind>_<开始>_<结束>.md"""
+    os.makedirs(output_dir, exist_ok=True)
+    paths = []
+    for kind, period_start, period_end, content in reports:
+        path = os.path.join(output_dir, f"{source}_{kind}_{period_start}_{period_end}.md")
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(content + "\n")
+        paths.append(path)
+    return paths
+
+
+def run_backfill(storage, source: str, build_daily_report, build_period_report, top_n: int,
+                 start_date_str: str, end_date_str: str, kind: str, device_names=None,
+                 output_dir=None, archive=False, send=None, send_interval=0, workers=None):
+    """
+    一次范围扫描生成 [开始, 结束] 内所有完整周期的报告，并行渲染后输出
+    - source: 报告来源 ("golf" / "waice")，用于文件名和 report_archive
+    - device_names: 只统计这些设备，None 为全部设备
+    - send: 发送函数 send(content)，None 时不发送；两次发送之间间隔 send_interval 秒
+    """
+    print("==========================================")
+    print(f"回填历史报告 ({kind})")
+    print(f"范围: {start_date_str} 至 {end_date_str}")
+    if device_names:
+        print(f"过滤模式: 仅统计 {len(device_names)} 台关注设备")
+    print("==========================================")
+
+    start_date = date.fromisoformat(start_date_str)
+    end_date = date.fromisoformat(end_date_str)
+
+    range_rows = storage.fetch_range_rows(start_date_str, end_date_str, device_names)
+    tasks = build_tasks(kind, start_date, end_date, range_rows, top_n)
+    if not tasks:
+        print("范围内没有完整的报告周期")
+        return
+
+    now_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    reports = render_reports(build_daily_report, build_period_report, tasks, now_time, workers)
+    print(f"已生成 {len(reports)} 份报告 (扫描 {len(range_rows)} 行数据)")
+
+    if output_dir:
+        paths = write_reports(output_dir, source, reports)
+        print(f"已写入 {len(paths)} 个报告文件到: {output_dir}")
+
+    if archive:
+        storage.archive_reports(source, reports)
+        print(f"已写入 {len(reports)} 份报告到 report_archive 表")
+
+    if send:
+        for i, (_, _, _, content) in enumerate(reports):
+            if i > 0:
+                time.sleep(send_interval)
+            send(content)
@@ -27,6 +27,22 @@ DNA_ID_PATH="/etc/dna_id"
 #    脚本将且仅将使用此路径的curl。如果它不存在或不可执行，数据将无法发送。
 CURL_EXEC="/etc/configs/curl-aarch64"
 
+# 6. 服务器建议的上报间隔上限 (单位: 秒)
+#    服务器会在响应中返回带随机抖动的 next_report_in (限流时为 Retry-After)，
+#    脚本按该值休眠，避免所有设备同时上报。超出此上限的建议值将被忽略。
+MAX_SUGGESTED_INTERVAL_SECONDS=3600
+
+# 7. 上报模式
+#    "delta":    只发送上次成功发送以来新增的击球数 (依赖状态文件，重复发送会重复计数)
+#    "absolute": 每次发送最近 RESEND_DAYS 天每天的击球总数 (包括已轮转的归档日志)，
+#                服务器只累加超出当天已存总数的部分，重复发送（包括升级固件后重发）不会重复计数，
+#                无需状态文件。需要服务器支持 mode=absolute。
+REPORT_MODE="delta"
+RESEND_DAYS=2
+
+# 本轮服务器建议的休眠时间，为空时使用 INTERVAL_SECONDS
+NEXT_SLEEP_SECONDS=""
+
 
 # ==================== 核心逻辑函数 (处理和发送数据) ====================
 
@@ -42,16 +58,18 @@ process_and_send_logs() {
         return 1 # 返回错误码，但不退出循环
     fi
 
-    # 创建一个临时文件来汇总计数
-    local temp_counts_file
+    # 创建临时文件来汇总计数和保存服务器响应
+    local temp_counts_file response_file
     temp_counts_file=$(mktemp)
+    response_file=$(mktemp)
     # 确保函数退出时删除临时文件
-    trap 'rm -f "$temp_counts_file"' RETURN
+    trap 'rm -f "$temp_counts_file" "$response_file"' RETURN
 
     # ==================== 已禁用：归档日志处理 ====================
     # 以下代码块已被禁用，以防止在日志轮转时重复计算数据。
     # 此前，该逻辑会重新处理整个归档文件，导致数据异常增加。
     # 禁用此功能可确保数据准确性，但可能导致轮转瞬间的少量数据丢失。
+    # (REPORT_MODE="absolute" 时归档日志会参与统计，重复发送不会重复计数。)
     #
     # shopt -s nullglob
     # local archived_logs=("$LOG_DIR"/log_*.txt)
@@ -67,8 +85,20 @@ process_and_send_logs() {
 
     # 3. 处理活动的日志 (log)
     local active_log_file="$LOG_DIR/log"
-    if [ -f "$active_log_file" ]; then
-        local state_file="$STATE_DIR/active_log.state"
+    local state_file="$STATE_DIR/active_log.state"
+    local pending_total_lines=""
+    if [ "$REPORT_MODE" = "absolute" ]; then
+        # absolute 模式: 统计归档日志和活动日志中最近 RESEND_DAYS 天每天的总击球数
+        shopt -s nullglob
+        local all_logs=("$LOG_DIR"/log_*.txt)
+        shopt -u nullglob
+        if [ -f "$active_log_file" ]; then
+            all_logs+=("$active_log_file")
+        fi
+        if [ ${#all_logs[@]} -gt 0 ]; then
+            cat "${all_logs[@]}" | grep "Final Result:" | cut -d' ' -f1 | sed 's/\[//' | sort | uniq -c | tail -n "$RESEND_DAYS" | awk '{print $1" "$2}' >> "$temp_counts_file"
+        fi
+    elif [ -f "$active_log_file" ]; then
         local last_line_processed
         last_line_processed=$(cat "$state_file" 2>/dev/null || echo 0)
         
@@ -84,7 +114,8 @@ process_and_send_logs() {
         if [ "$new_lines_count" -gt 0 ]; then
             echo "$(date): 发现 $new_lines_count 条新日志，正在处理..."
             tail -n "$new_lines_count" "$active_log_file" | grep "Final Result:" | cut -d' ' -f1 | sed 's/\[//' | sort | uniq -c | awk '{print $1" "$2}' >> "$temp_counts_file"
-            echo "$current_total_lines" > "$state_file"
+            # 状态文件在数据发送成功后才更新，被限流或发送失败时下一轮会重新统计
+            pending_total_lines="$current_total_lines"
         fi
     fi
 
@@ -100,7 +131,7 @@ process_and_send_logs() {
 
         # 【已修正】构建JSON负载
         local json_payload
-        json_payload="{\"device_id\": \"$device_id\", \"firmware_version\": \"$firmware_version\", \"daily_data\": {"
+        json_payload="{\"device_id\": \"$device_id\", \"firmware_version\": \"$firmware_version\", \"mode\": \"$REPORT_MODE\", \"daily_data\": {"
         local first=true
         for item in $aggregated_data; do
             local date count
@@ -124,14 +155,26 @@ process_and_send_logs() {
         
         # 5. 使用 curl 发送数据
         local response_code
-        response_code=$("$CURL_EXEC" -s -o /dev/null -w "%{http_code}" \
+        response_code=$("$CURL_EXEC" -s -o "$response_file" -w "%{http_code}" \
             -X POST \
             -H "Content-Type: application/json" \
             -d "$json_payload" \
             "$SERVER_URL")
         
+        # 服务器建议的下次上报间隔 (成功和限流响应中都有 next_report_in)
+        local suggested_interval
+        suggested_interval=$(grep -o '"next_report_in": *[0-9]*' "$response_file" | grep -o '[0-9]*$')
+        if [[ "$suggested_interval" =~ ^[0-9]+$ ]] && [ "$suggested_interval" -gt 0 ] && [ "$suggested_interval" -le "$MAX_SUGGESTED_INTERVAL_SECONDS" ]; then
+            NEXT_SLEEP_SECONDS="$suggested_interval"
+        fi
+
         if [[ "$response_code" == "200" || "$response_code" == "201" ]]; then
             echo "$(date): 数据发送成功！服务器响应码: $response_code"
+            if [ -n "$pending_total_lines" ]; then
+                echo "$pending_total_lines" > "$state_file"
+            fi
+        elif [[ "$response_code" == "429" ]]; then
+            echo "$(date): 服务器繁忙 (429)，将在 ${NEXT_SLEEP_SECONDS:-$INTERVAL_SECONDS} 秒后重试。"
         else
             echo "$(date): 错误: 数据发送失败！服务器响应码: $response_code"
         fi
@@ -139,6 +182,10 @@ process_and_send_logs() {
 
     else
         echo "$(date): 没有发现新的击球数据。"
+        # 新日志中没有击球记录，直接推进状态
+        if [ -n "$pending_total_lines" ]; then
+            echo "$pending_total_lines" > "$state_file"
+        fi
     fi
 }
 
@@ -150,7 +197,9 @@ echo "脚本已启动。将进入无限循环，每 ${INTERVAL_SECONDS} 秒执
 echo "请使用 'nohup ./your_script_name.sh &> /var/log/hitlog.log &' 将其在后台稳定运行。"
 
 while true; do
+    NEXT_SLEEP_SECONDS=""
     process_and_send_logs
-    echo "$(date): 任务完成，将休眠 $INTERVAL_SECONDS 秒..."
-    sleep "$INTERVAL_SECONDS"
+    sleep_seconds="${NEXT_SLEEP_SECONDS:-$INTERVAL_SECONDS}"
+    echo "$(date): 任务完成，将休眠 $sleep_seconds 秒..."
+    sleep "$sleep_seconds"
 done
\ No newline at end of file
@@ -31,6 +31,14 @@ CURL_EXEC="/etc/configs/curl-aarch64"
 DATA_STORE_FILE="/etc/configs/data_store"
 STATE_FILE_SHOTTIMES="$STATE_DIR/last_sent_shottimes.state"
 
+# 7. 服务器建议的上报间隔上限 (单位: 秒)
+#    服务器会在响应中返回带随机抖动的 next_report_in (限流时为 Retry-After)，
+#    脚本按该值休眠，避免所有设备同时上报。超出此上限的建议值将被忽略。
+MAX_SUGGESTED_INTERVAL_SECONDS=3600
+
+# 本轮服务器建议的休眠时间，为空时使用 INTERVAL_SECONDS
+NEXT_SLEEP_SECONDS=""
+
 
 # ==================== 核心逻辑函数 (处理和发送数据) ====================
 
@@ -97,12 +105,21 @@ process_and_send_logs() {
         echo "$(date): 使用 '$CURL_EXEC' 发送JSON: $json_payload"
         
         # 使用 curl 发送数据，并获取HTTP响应码
-        local response_code
-        response_code=$("$CURL_EXEC" -s -o /dev/null -w "%{http_code}" \
+        local response_file response_code
+        response_file=$(mktemp)
+        trap 'rm -f "$response_file"' RETURN
+        response_code=$("$CURL_EXEC" -s -o "$response_file" -w "%{http_code}" \
             -X POST \
             -H "Content-Type: application/json" \
             -d "$json_payload" \
             "$SERVER_URL")
+
+        # 服务器建议的下次上报间隔 (成功和限流响应中都有 next_report_in)
+        local suggested_interval
+        suggested_interval=$(grep -o '"next_report_in": *[0-9]*' "$response_file" | grep -o '[0-9]*$')
+        if [[ "$suggested_interval" =~ ^[0-9]+$ ]] && [ "$suggested_interval" -gt 0 ] && [ "$suggested_interval" -le "$MAX_SUGGESTED_INTERVAL_SECONDS" ]; then
+            NEXT_SLEEP_SECONDS="$suggested_interval"
+        fi
         
         # 【关键】根据服务器响应决定是否更新状态
         if [[ "$response_code" == "200" || "$response_code" == "201" ]]; then
@@ -110,6 +127,8 @@ process_and_send_logs() {
             # 仅在发送成功后，将当前的 *总数* 写入状态文件，作为新的标记点
             echo "$current_total_shottimes" > "$STATE_FILE_SHOTTIMES"
             echo "$(date): 状态已更新，已发送总击球数标记为: $current_total_shottimes"
+        elif [[ "$response_code" == "429" ]]; then
+            echo "$(date): 服务器繁忙 (429)，将在 ${NEXT_SLEEP_SECONDS:-$INTERVAL_SECONDS} 秒后重试发送这 $new_hits_count 次击球。"
         else
             echo "$(date): 错误: 数据发送失败！服务器响应码: $response_code"
             echo "$(date): 重要: 状态文件未更新，将在下一周期重试发送这 $new_hits_count 次击球。"
@@ -127,7 +146,9 @@ echo "脚本已启动。将进入无限循环，每 ${INTERVAL_SECONDS} 秒执
 echo "请使用 'nohup ./your_script_name.sh &> /var/log/hitlog.log &' 将其在后台稳定运行。"
 
 while true; do
+    NEXT_SLEEP_SECONDS=""
     process_and_send_logs
-    echo "$(date): 任务完成，将休眠 $INTERVAL_SECONDS 秒..."
-    sleep "$INTERVAL_SECONDS"
+    sleep_seconds="${NEXT_SLEEP_SECONDS:-$INTERVAL_SECONDS}"
+    echo "$(date): 任务完成，将休眠 $sleep_seconds 秒..."
+    sleep "$sleep_seconds"
 done
\ No newline at end of file
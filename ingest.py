@@ -0,0 +1,66 @@
+"""Payload validation for the ``/api/golf_stats`` ingest contract.
+
+Three ingest modes, selected by the optional ``mode`` field:
+
+- ``delta`` (default): ``daily_data`` holds hits since the device's last
+  report and is added to the stored counts. Resending double-counts.
+- ``absolute``: ``daily_data`` holds the device's full per-day totals
+  (across firmware versions); the server only adds what exceeds the day's
+  stored total, so resends are harmless.
+- ``counter``: ``counter`` is a monotonically increasing hit counter and
+  ``boot_id`` identifies the boot it counts from. The server remembers the
+  last counter of every boot it has seen and adds only the difference to
+  ``date`` (default: today), so resending any earlier counter adds nothing.
+"""
+from collections import namedtuple
+from datetime import date
+
+INGEST_MODES = ('delta', 'absolute', 'counter')
+
+IngestRequest = namedtuple('IngestRequest', 'device_id firmware_version mode daily_data boot_id counter date')
+
+
+def _is_count(value):
+    return isinstance(value, int) and not isinstance(value, bool) and value >= 0
+
+
+def _check_date(date_str):
+    try:
+        date.fromisoformat(date_str)
+    except (TypeError, ValueError):
+        raise ValueError(f'Invalid date: {date_str}')
+
+
+def parse_golf_stats(data):
+    """Validate a decoded JSON payload, raising ``ValueError`` with the client-facing message."""
+    if not isinstance(data, dict) or 'device_id' not in data:
+        raise ValueError('Invalid data format')
+
+    mode = data.get('mode', 'delta')
+    if mode not in INGEST_MODES:
+        raise ValueError(f'Invalid mode: {mode} (expected one of {", ".join(INGEST_MODES)})')
+
+    device_id = data['device_id']
+    if not isinstance(device_id, str) or not device_id:
+        raise ValueError('device_id must be a non-empty string')
+    firmware_version = data.get('firmware_version', 'unknown')
+
+    if mode == 'counter':
+        if 'boot_id' not in data or 'counter' not in data:
+            raise ValueError('Invalid data format')
+        if not _is_count(data['counter']):
+            raise ValueError('counter must be a non-negative integer')
+        report_date = data.get('date') or date.today().isoformat()
+        _check_date(report_date)
+        return IngestRequest(device_id, firmware_version, mode, None, str(data['boot_id']), data['counter'], report_date)
+
+    if 'daily_data' not in data:
+        raise ValueError('Invalid data format')
+    daily_data = data['daily_data']
+    if not isinstance(daily_data, dict):
+        raise ValueError('Invalid data format')
+    for date_str, hit_count in daily_data.items():
+        _check_date(date_str)
+        if not _is_count(hit_count):
+            raise ValueError('daily_data values must be non-negative integers')
+    return IngestRequest(device_id, firmware_version, mode, daily_data, None, None, None)
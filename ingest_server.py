@@ -0,0 +1,299 @@
+"""Asyncio ingest service for ``POST /api/golf_stats``.
+
+Same request contract, validation and responses as ``receive_golf_stats``
+in app.py, but device connections are served by one event loop instead of a
+Flask worker each, so thousands of slow or idle keep-alive connections cost
+a socket and a coroutine apiece. Requests are parsed and validated on the
+loop; valid writes go to a single ``IngestWriter`` thread that commits them
+in batches (one SQLite transaction per batch).
+
+Run it next to the Flask dashboard on the same database and point the
+device agents at its port::
+
+    GOLF_INGEST_PORT=5001 python ingest_server.py
+
+Only ``/api/golf_stats`` is served; dashboards and admin endpoints stay in
+app.py, whose read snapshot picks up these writes on its next refresh.
+"""
+import asyncio
+import json
+import logging
+import os
+import queue
+import signal
+import threading
+import time
+
+from admission import AdmissionController
+from ingest import parse_golf_stats
+from storage import open_storage
+
+logger = logging.getLogger(__name__)
+
+INGEST_PATH = '/api/golf_stats'
+MAX_BODY_BYTES = 1024 * 1024
+MAX_HEADER_LINES = 100
+
+REASONS = {
+    201: 'Created',
+    400: 'Bad Request',
+    404: 'Not Found',
+    405: 'Method Not Allowed',
+    408: 'Request Timeout',
+    411: 'Length Required',
+    413: 'Payload Too Large',
+    429: 'Too Many Requests',
+    431: 'Request Header Fields Too Large',
+    500: 'Internal Server Error',
+}
+
+
+class HttpError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class IngestWriter:
+    """Single writer thread: drains queued ingests and commits them in batches.
+
+    A batch is whatever is queued when the thread wakes up, plus anything
+    arriving within ``batch_wait_seconds``, capped at ``batch_max``.
+    """
+
+    def __init__(self, storage, batch_max=200, batch_wait_seconds=0.02):
+        self.storage = storage
+        self.batch_max = batch_max
+        self.batch_wait_seconds = batch_wait_seconds
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name='ingest-writer', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        """Write everything already queued, then stop the thread."""
+        self._queue.put(None)
+        self._thread.join()
+
+    def submit(self, ingest):
+        """Queue one ``IngestRequest``; returns an asyncio future resolved once it is committed."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._queue.put((ingest, loop, future))
+        return future
+
+    def _next_batch(self):
+        item = self._queue.get()
+        if item is None:
+            return None
+        batch = [item]
+        deadline = time.monotonic() + self.batch_wait_seconds
+        while len(batch) < self.batch_max:
+            try:
+                item = self._queue.get(timeout=max(0, deadline - time.monotonic()))
+            except queue.Empty:
+                break
+            if item is None:
+                # Finish this batch, stop on the next call
+                self._queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            try:
+                errors = self.storage.write_batch([ingest for ingest, _, _ in batch])
+            except Exception as e:
+                logger.exception('Ingest batch of %d failed', len(batch))
+                errors = [e] * len(batch)
+            for (_, loop, future), error in zip(batch, errors):
+                try:
+                    loop.call_soon_threadsafe(_resolve, future, error)
+                except RuntimeError:
+                    pass  # loop already closed during shutdown, the write itself went through
+
+
+def _resolve(future, error):
+    if future.cancelled():
+        return
+    if error is None:
+        future.set_result(None)
+    else:
+        future.set_exception(error)
+
+
+class IngestServer:
+    """Minimal HTTP/1.1 server (keep-alive, Content-Length bodies) for the ingest endpoint."""
+
+    def __init__(self, admission, writer, idle_timeout=75, request_timeout=30):
+        self.admission = admission
+        self.writer = writer
+        self.idle_timeout = idle_timeout
+        self.request_timeout = request_timeout
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                try:
+                    request_line = await asyncio.wait_for(reader.readline(), self.idle_timeout)
+                except asyncio.TimeoutError:
+                    break
+                if not request_line:
+                    break
+
+                try:
+                    method, path, version, headers, body = await asyncio.wait_for(
+                        self._read_request(request_line, reader, writer), self.request_timeout)
+                except HttpError as e:
+                    await self._send(writer, e.status, {'error': str(e)}, keep_alive=False)
+                    break
+                except asyncio.TimeoutError:
+                    await self._send(writer, 408, {'error': 'Request timeout'}, keep_alive=False)
+                    break
+
+                connection = headers.get('connection', '').lower()
+                keep_alive = connection != 'close' and (version == 'HTTP/1.1' or connection == 'keep-alive')
+
+                status, payload, extra_headers = await self._dispatch(method, path, body)
+                await self._send(writer, status, payload, keep_alive, extra_headers)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError):
+            pass  # client went away or sent an oversized line
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def _read_request(self, request_line, reader, writer):
+        try:
+            method, target, version = request_line.decode('latin-1').split()
+        except ValueError:
+            raise HttpError(400, 'Malformed request line')
+
+        headers = {}
+        for _ in range(MAX_HEADER_LINES):
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        else:
+            raise HttpError(431, 'Too many headers')
+
+        if 'chunked' in headers.get('transfer-encoding', '').lower():
+            raise HttpError(411, 'Chunked bodies are not supported, send Content-Length')
+        try:
+            length = int(headers.get('content-length', 0))
+        except ValueError:
+            raise HttpError(400, 'Invalid Content-Length')
+        if length > MAX_BODY_BYTES:
+            raise HttpError(413, 'Request body too large')
+        if headers.get('expect', '').lower() == '100-continue':
+            # curl sends this for bodies over 1 KB and otherwise waits a second before sending
+            writer.write(b'HTTP/1.1 100 Continue\r\n\r\n')
+            await writer.drain()
+        body = await reader.readexactly(length) if length > 0 else b''
+        return method, target.split('?', 1)[0], version, headers, body
+
+    async def _dispatch(self, method, path, body):
+        if path != INGEST_PATH:
+            return 404, {'error': 'Not found'}, None
+        if method != 'POST':
+            return 405, {'error': 'Method not allowed'}, {'Allow': 'POST'}
+        try:
+            return await self.receive_golf_stats(body)
+        except Exception as e:
+            return 500, {'error': str(e)}, None
+
+    async def receive_golf_stats(self, body):
+        """Mirror of app.receive_golf_stats: validate, admit, write, answer."""
+        try:
+            data = json.loads(body) if body else None
+        except ValueError:
+            return 400, {'error': 'Invalid JSON'}, None
+        try:
+            ingest = parse_golf_stats(data)
+        except ValueError as e:
+            return 400, {'error': str(e)}, None
+
+        if not self.admission.acquire_slot():
+            return self.too_many_requests(self.admission.busy_retry_after())
+        try:
+            retry_after = self.admission.check_device(ingest.device_id)
+            if retry_after:
+                return self.too_many_requests(retry_after)
+            await self.writer.submit(ingest)
+        finally:
+            self.admission.release_slot()
+
+        return 201, {'status': 'success', 'next_report_in': self.admission.next_report_interval()}, None
+
+    @staticmethod
+    def too_many_requests(retry_after):
+        payload = {'error': 'Too many requests', 'retry_after': retry_after, 'next_report_in': retry_after}
+        return 429, payload, {'Retry-After': str(retry_after)}
+
+    @staticmethod
+    async def _send(writer, status, payload, keep_alive, extra_headers=None):
+        body = json.dumps(payload).encode('utf-8')
+        headers = {
+            'Content-Type': 'application/json',
+            'Content-Length': str(len(body)),
+            'Connection': 'keep-alive' if keep_alive else 'close',
+        }
+        headers.update(extra_headers or {})
+        head = f'HTTP/1.1 {status} {REASONS.get(status, "")}\r\n'
+        head += ''.join(f'{name}: {value}\r\n' for name, value in headers.items())
+        writer.write(head.encode('latin-1') + b'\r\n' + body)
+        await writer.drain()
+
+
+async def serve(host, port, admission, writer):
+    server = IngestServer(admission, writer,
+                          idle_timeout=float(os.environ.get('GOLF_INGEST_IDLE_TIMEOUT_SECONDS', 75)))
+    tcp_server = await asyncio.start_server(server.handle_connection, host, port,
+                                            backlog=int(os.environ.get('GOLF_INGEST_BACKLOG', 1024)))
+    logger.info('Ingest service listening on %s:%s', host, port)
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    async with tcp_server:
+        await stop.wait()
+    logger.info('Ingest service stopping, flushing queued writes')
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+    storage = open_storage()
+    storage.init_schema()
+
+    # The concurrency cap bounds writes waiting on the writer thread, not request threads
+    admission = AdmissionController.from_env(
+        max_concurrent=int(os.environ.get('GOLF_INGEST_MAX_PENDING_WRITES', 1024)))
+    writer = IngestWriter(
+        storage,
+        batch_max=int(os.environ.get('GOLF_INGEST_BATCH_MAX', 200)),
+        batch_wait_seconds=float(os.environ.get('GOLF_INGEST_BATCH_WAIT_MS', 20)) / 1000,
+    )
+    writer.start()
+    try:
+        asyncio.run(serve(os.environ.get('GOLF_INGEST_HOST', '0.0.0.0'),
+                          int(os.environ.get('GOLF_INGEST_PORT', 5001)),
+                          admission, writer))
+    finally:
+        writer.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+在存储布局之间迁移 daily_stats 数据
+
+示例:
+    python3 migrate_storage.py --db data/golf_stats.db --from single --to sharded
+    python3 migrate_storage.py --db data/golf_stats.db --from sharded --to single
+"""
+
+import argparse
+import os
+import sys
+
+from storage import BACKENDS, open_storage
+
+
+def migrate(db_path: str, source_backend: str, target_backend: str, keep_source: bool = False):
+    """复制全部 daily_stats 行到目标布局，校验行数与击球总数后清理源数据"""
+    if source_backend == target_backend:
+        raise ValueError("源布局与目标布局相同，无需迁移")
+    if not os.path.exists(db_path):
+        raise FileNotFoundError(f"数据库文件不存在: {db_path}")
+
+    source = open_storage(db_path, source_backend)
+    target = open_storage(db_path, target_backend)
+    target.init_schema()
+
+    if target.count_daily_stats()[0] > 0:
+        raise RuntimeError("目标布局中已存在数据，已中止迁移")
+
+    expected = source.count_daily_stats()
+    print(f"源数据: {expected[0]} 行, 击球总数 {expected[1]}")
+
+    target.bulk_load_daily_stats(source.iter_daily_stats())
+    # 原始行导入不经过入库逻辑，周期汇总 (period_totals / period_summary) 需按新数据重建
+    target.rebuild_period_totals()
+
+    actual = target.count_daily_stats()
+    print(f"目标数据: {actual[0]} 行, 击球总数 {actual[1]}")
+    if actual != expected:
+        raise RuntimeError("迁移校验失败: 源与目标的数据不一致，源数据已保留")
+
+    if keep_source:
+        print("已保留源数据 (--keep-source)")
+        return
+
+    if source_backend == 'single':
+        conn = source.connect()
+        try:
+            conn.execute('DROP TABLE daily_stats')
+            conn.commit()
+            conn.execute('VACUUM')
+        finally:
+            conn.close()
+    else:
+        for month in source.shard_months():
+            os.remove(source.shard_path(month))
+    print("已清理源数据")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="在 single / sharded 存储布局之间迁移数据")
+    parser.add_argument('--db', default=os.environ.get('GOLF_DB_PATH', 'data/golf_stats.db'), help='主数据库文件路径')
+    parser.add_argument('--from', dest='source', choices=BACKENDS, required=True, help='当前存储布局')
+    parser.add_argument('--to', dest='target', choices=BACKENDS, required=True, help='目标存储布局')
+    parser.add_argument('--keep-source', action='store_true', help='迁移后保留源数据')
+    args = parser.parse_args()
+
+    try:
+        migrate(args.db, args.source, args.target, args.keep_source)
+    except (ValueError, FileNotFoundError, RuntimeError) as e:
+        print(f"错误: {e}")
+        sys.exit(1)
+
+    print(f"迁移完成: {args.source} -> {args.target}")
+    print(f"请将 GOLF_STORAGE_BACKEND 设置为 {args.target}")
+
+
+if __name__ == "__main__":
+    main()
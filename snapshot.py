@@ -0,0 +1,143 @@
+"""In-memory read snapshot for dashboard and analytics queries.
+
+``ReadSnapshot`` keeps a private in-memory copy of the database, taken with
+the sqlite3 backup API (see ``Storage.snapshot_into``). Reads are served from
+that copy, so they never wait on ingest write locks. A background thread
+re-takes the copy every ``interval_seconds``, or sooner once
+``refresh_after_writes`` ingest writes have been reported via ``note_write``.
+
+Each copy is a named shared-cache memory database: every read opens its own
+connection to the current copy, so reads run side by side, and a replaced
+copy is freed once the last read still using it closes its connection.
+
+Staleness bound: the copy being served was taken when refresh k started and
+is replaced only when refresh k+1 finishes, so a read sees data at most
+``interval_seconds`` plus two refresh durations old. ``staleness_headers``
+exposes the actual age and that bound (taking the slowest of the last
+``RECENT_REFRESHES`` refreshes for both); while refreshes fail there is no
+bound, and only the age is reported.
+"""
+import logging
+import sqlite3
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+from storage import Storage
+
+logger = logging.getLogger(__name__)
+
+# Refresh durations kept for the advertised staleness bound
+RECENT_REFRESHES = 10
+
+
+class ReadSnapshot(Storage):
+    """Read-only ``Storage`` over an in-memory copy of ``source``."""
+
+    backend = 'snapshot'
+
+    def __init__(self, source, interval_seconds=10, refresh_after_writes=100):
+        super().__init__(source.db_path)
+        self.source = source
+        self.interval_seconds = interval_seconds
+        self.refresh_after_writes = refresh_after_writes
+        self._conn = None                      # keeps the current copy alive
+        self._uri = None
+        self._copies = 0
+        self._taken_at = None
+        self._refresh_seconds = deque(maxlen=RECENT_REFRESHES)
+        self._refresh_failed = False
+        self._writes = 0
+        self._lock = threading.Lock()          # guards the swap of the current copy
+        self._writes_lock = threading.Lock()   # guards the write counter, never held during reads
+        self._refresh_lock = threading.Lock()  # one refresh at a time
+        self._start_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def refresh(self):
+        """Take a fresh copy and swap it in; reads already running finish on the old one."""
+        with self._refresh_lock:
+            with self._writes_lock:
+                writes_before = self._writes
+            taken_at = time.time()
+
+            self._copies += 1
+            uri = f'file:read_snapshot_{id(self)}_{self._copies}?mode=memory&cache=shared'
+            conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+            try:
+                self.source.snapshot_into(conn)
+            except Exception:
+                conn.close()
+                self._refresh_failed = True
+                raise
+
+            with self._lock:
+                old, self._conn, self._uri, self._taken_at = self._conn, conn, uri, taken_at
+                self._refresh_seconds.append(time.time() - taken_at)
+                self._refresh_failed = False
+            with self._writes_lock:
+                self._writes -= writes_before
+            if old is not None:
+                # The old copy lives on until the reads still connected to it close
+                old.close()
+
+    def note_write(self):
+        """Called after each ingest write; wakes the refresher after ``refresh_after_writes`` writes."""
+        with self._writes_lock:
+            self._writes += 1
+            due = self.refresh_after_writes and self._writes >= self.refresh_after_writes
+        if due:
+            self._wakeup.set()
+
+    def _ensure_started(self):
+        """Take the first snapshot and start the refresher on first use."""
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is not None:
+                return
+            if self._conn is None:
+                self.refresh()
+            thread = threading.Thread(target=self._run, name='read-snapshot', daemon=True)
+            thread.start()
+            self._thread = thread
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.interval_seconds)
+            self._wakeup.clear()
+            try:
+                self.refresh()
+            except Exception:
+                logger.exception('Read snapshot refresh failed, keeping the previous snapshot')
+
+    @contextmanager
+    def read_connection(self, start_date=None, end_date=None):
+        self._ensure_started()
+        with self._lock:
+            # Connect before releasing the lock, so the copy cannot be freed in between
+            conn = sqlite3.connect(self._uri, uri=True)
+        conn.row_factory = sqlite3.Row
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def connect(self):
+        raise TypeError('ReadSnapshot is read-only, use the source storage for writes')
+
+    def staleness_headers(self):
+        """Response headers describing how old the served data may be."""
+        self._ensure_started()
+        with self._lock:
+            taken_at, refresh_seconds, refresh_failed = self._taken_at, max(self._refresh_seconds), self._refresh_failed
+        headers = {
+            'X-Snapshot-Taken-At': datetime.fromtimestamp(taken_at, timezone.utc).isoformat(timespec='seconds'),
+            'X-Snapshot-Age': f'{max(0.0, time.time() - taken_at):.3f}',
+        }
+        if not refresh_failed:
+            headers['X-Snapshot-Max-Staleness'] = f'{self.interval_seconds + 2 * refresh_seconds:.3f}'
+        return headers
@@ -0,0 +1,1046 @@
+"""Storage backends for golf hit statistics.
+
+app.py, golf.py and waice.py talk to the database only through a ``Storage``
+object returned by ``open_storage``. Two layouts are available:
+
+- ``single``:  ``devices`` and ``daily_stats`` live in one SQLite file
+  (the original ``data/golf_stats.db`` layout).
+- ``sharded``: ``devices`` stays in the main file, ``daily_stats`` is split
+  into one SQLite file per month under ``<db dir>/shards/``. Writes open
+  the month files they touch directly, range reads attach the months in
+  range and expose them as a single ``daily_stats`` view.
+
+Use ``migrate_storage.py`` to move an existing database between layouts.
+"""
+import json
+import os
+import re
+import sqlite3
+from contextlib import contextmanager
+from datetime import date, timedelta
+
+DEFAULT_DB_PATH = 'data/golf_stats.db'
+BACKENDS = ('single', 'sharded')
+
+DEVICES_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS devices (
+        device_id TEXT PRIMARY KEY,
+        device_name TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+'''
+
+DAILY_STATS_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS {schema}daily_stats (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        device_id TEXT,
+        date TEXT,
+        hit_count INTEGER,
+        firmware_version TEXT DEFAULT 'unknown',
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        {foreign_key}UNIQUE(device_id, date, firmware_version)
+    )
+'''
+
+# Serves the per-firmware aggregates and comparisons
+DAILY_STATS_INDEX = 'CREATE INDEX IF NOT EXISTS {schema}idx_daily_stats_fw_date ON daily_stats (firmware_version, date)'
+
+REPORT_ARCHIVE_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS report_archive (
+        source TEXT,
+        kind TEXT,
+        period_start TEXT,
+        period_end TEXT,
+        content TEXT,
+        generated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (source, kind, period_start, period_end)
+    )
+'''
+
+DAILY_STATS_COLUMNS = 'device_id, date, hit_count, firmware_version, created_at'
+
+# Last counter seen per device and boot for the ``counter`` ingest mode (see
+# ingest.py); earlier boots are kept so their delayed retries add nothing
+DEVICE_COUNTERS_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS device_counters (
+        device_id TEXT,
+        boot_id TEXT,
+        last_counter INTEGER,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (device_id, boot_id)
+    )
+'''
+
+# Every ingest mode ends up adding hits (absolute totals are first reduced to
+# what is not stored yet, see ``_merge_daily``)
+UPSERT_DAILY_STATS = '''
+    INSERT INTO daily_stats (device_id, date, hit_count, firmware_version)
+    VALUES (?, ?, ?, ?)
+    ON CONFLICT(device_id, date, firmware_version) DO UPDATE SET
+    hit_count = hit_count + excluded.hit_count
+'''
+
+# Bumped once per ingest write touching a date; stamps only grow, so the sum
+# over a date range changes whenever data inside the range does
+CHANGE_STAMPS_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS change_stamps (
+        date TEXT PRIMARY KEY,
+        stamp INTEGER DEFAULT 0,
+        changed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+'''
+
+# Computed report aggregates, valid while the stamp sum of their range is unchanged
+REPORT_CACHE_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS report_cache (
+        kind TEXT,
+        start_date TEXT,
+        end_date TEXT,
+        device_filter TEXT,
+        stamp_sum INTEGER,
+        payload TEXT,
+        computed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (kind, start_date, end_date, device_filter)
+    )
+'''
+
+# Per-device running totals per calendar day / week (Monday first) / month.
+# Every ingest write updates them, so leaderboards and summaries read the top
+# rows of an index instead of aggregating daily_stats.
+PERIODS = ('day', 'week', 'month')
+
+PERIOD_TOTALS_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS period_totals (
+        period TEXT,
+        period_key TEXT,
+        device_id TEXT,
+        hit_count INTEGER DEFAULT 0,
+        firmware_version TEXT,
+        PRIMARY KEY (period, period_key, device_id)
+    )
+'''
+
+PERIOD_TOTALS_INDEX = 'CREATE INDEX IF NOT EXISTS idx_period_totals_rank ON period_totals (period, period_key, hit_count DESC)'
+
+PERIOD_SUMMARY_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS period_summary (
+        period TEXT,
+        period_key TEXT,
+        total_hits INTEGER DEFAULT 0,
+        active_devices INTEGER DEFAULT 0,
+        PRIMARY KEY (period, period_key)
+    )
+'''
+
+# period_key() over daily_stats.date, used when rebuilding the totals
+PERIOD_KEY_SQL = {
+    'day': 'date',
+    'week': "date(date, '-6 days', 'weekday 1')",
+    'month': 'substr(date, 1, 7)',
+}
+
+
+def period_key(period, date_str):
+    """Bucket key of ``date_str``: the date itself, its week's Monday, or ``YYYY-MM``."""
+    start, _ = period_bounds(period, date_str)
+    return start[:7] if period == 'month' else start
+
+
+def period_bounds(period, date_str):
+    """First and last date of the ``period`` bucket containing ``date_str``."""
+    day = date.fromisoformat(date_str)
+    if period == 'day':
+        start, end = day, day
+    elif period == 'week':
+        start = day - timedelta(days=day.weekday())
+        end = start + timedelta(days=6)
+    elif period == 'month':
+        start = day.replace(day=1)
+        end = (start + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+    else:
+        raise ValueError(f'Unknown period: {period} (expected one of {", ".join(PERIODS)})')
+    return start.isoformat(), end.isoformat()
+
+
+def month_of(date_str):
+    """Return the ``YYYY-MM`` shard key of a ``YYYY-MM-DD`` date string."""
+    return date.fromisoformat(date_str).strftime('%Y-%m')
+
+
+class Storage:
+    """Common query logic shared by every backend.
+
+    Subclasses provide connections (``connect`` / ``read_connection``) and the
+    write paths; every read query below runs against an unqualified
+    ``daily_stats`` so it works unchanged on any layout.
+    """
+
+    backend = None
+
+    def __init__(self, db_path=DEFAULT_DB_PATH):
+        self.db_path = db_path
+
+    def connect(self):
+        """Connection to the main database file (``devices`` lives here)."""
+        conn = sqlite3.connect(self.db_path)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def init_schema(self):
+        raise NotImplementedError
+
+    def read_connection(self, start_date=None, end_date=None):
+        """Context manager yielding a connection where ``daily_stats`` covers
+        at least ``[start_date, end_date]`` (everything when unbounded)."""
+        raise NotImplementedError
+
+    def write_ingest(self, ingest):
+        """Apply one parsed ``IngestRequest`` (see ingest.py) in its own transaction."""
+        self._write([ingest])
+
+    def write_batch(self, ingests):
+        """Apply several ``IngestRequest`` objects, in one write transaction when possible.
+
+        Returns one entry per request: ``None`` if it was written, else the
+        exception it raised. If the shared transaction fails it is rolled
+        back and the requests are retried one by one, so a bad request only
+        fails itself.
+        """
+        try:
+            self._write(ingests)
+            return [None] * len(ingests)
+        except Exception:
+            return self._write_each(ingests)
+
+    def _write(self, ingests):
+        """Apply ``ingests`` together, raising (with nothing written) on the first error."""
+        raise NotImplementedError
+
+    def _write_each(self, ingests):
+        errors = []
+        for ingest in ingests:
+            try:
+                self._write([ingest])
+                errors.append(None)
+            except Exception as e:
+                errors.append(e)
+        return errors
+
+    @staticmethod
+    def _merge_daily(daily_for, ingest):
+        """``daily_stats`` half of a delta / absolute ingest, inside open write transactions.
+
+        ``daily_for(date_str)`` returns the connection holding that date's
+        rows. Returns ``[(date, hits actually added)]`` for ``_record_ingest``;
+        counter ingests are handled there entirely.
+
+        An absolute total covers the device's whole day, whatever firmware
+        it ran, so it is compared with the day's rows under every firmware
+        and only the hits beyond them are added, under the reporting one.
+        """
+        if ingest.mode == 'counter':
+            return []
+        changes = []
+        for date_str, hit_count in ingest.daily_data.items():
+            conn = daily_for(date_str)
+            added = hit_count
+            if ingest.mode == 'absolute':
+                row = conn.execute('''
+                    SELECT COUNT(*), COALESCE(SUM(hit_count), 0) FROM daily_stats
+                    WHERE device_id = ? AND date = ?
+                ''', (ingest.device_id, date_str)).fetchone()
+                added = max(0, hit_count - row[1])
+                if row[0] and not added:
+                    continue  # a resend with nothing new
+            conn.execute(UPSERT_DAILY_STATS, (ingest.device_id, date_str, added, ingest.firmware_version))
+            changes.append((date_str, added))
+        return changes
+
+    @staticmethod
+    def _record_ingest(conn, daily_for, ingest, changes):
+        """Main-file half of an ingest, inside an open write transaction on ``conn``.
+
+        Registers the device, does the counter bookkeeping of counter
+        ingests, then carries ``changes`` into the period totals and change
+        stamps.
+        """
+        conn.execute('INSERT OR IGNORE INTO devices (device_id) VALUES (?)', (ingest.device_id,))
+        if ingest.mode == 'counter':
+            added = Storage._advance_counter(conn, ingest.device_id, ingest.boot_id, ingest.counter)
+            if added:
+                daily_for(ingest.date).execute(
+                    UPSERT_DAILY_STATS, (ingest.device_id, ingest.date, added, ingest.firmware_version))
+                changes = [(ingest.date, added)]
+        for date_str, added in changes:
+            Storage._record_period_hits(conn, ingest.device_id, ingest.firmware_version, date_str, added)
+            Storage._stamp_date(conn, date_str)
+
+    @staticmethod
+    def _advance_counter(conn, device_id, boot_id, counter):
+        """Counter bookkeeping, returns how many hits the new ``counter`` adds.
+
+        A boot seen before: add ``counter - last_counter`` (never negative,
+        so stale or repeated reports add nothing, including delayed retries
+        from an earlier boot). A new boot: the counter started from zero,
+        add all of it.
+        """
+        row = conn.execute('SELECT last_counter FROM device_counters WHERE device_id = ? AND boot_id = ?',
+                           (device_id, boot_id)).fetchone()
+        if row is not None:
+            added = max(0, counter - row['last_counter'])
+            last_counter = max(counter, row['last_counter'])
+        else:
+            added = counter
+            last_counter = counter
+
+        conn.execute('''
+            INSERT INTO device_counters (device_id, boot_id, last_counter) VALUES (?, ?, ?)
+            ON CONFLICT(device_id, boot_id) DO UPDATE SET
+            last_counter = excluded.last_counter, updated_at = CURRENT_TIMESTAMP
+        ''', (device_id, boot_id, last_counter))
+        return added
+
+    @staticmethod
+    def _stamp_date(conn, date_str):
+        """Mark ``date_str`` as changed, invalidating cached reports whose range covers it."""
+        conn.execute('''
+            INSERT INTO change_stamps (date, stamp) VALUES (?, 1)
+            ON CONFLICT(date) DO UPDATE SET stamp = stamp + 1, changed_at = CURRENT_TIMESTAMP
+        ''', (date_str,))
+
+    @staticmethod
+    def _record_period_hits(conn, device_id, firmware_version, date_str, added):
+        """Add ``added`` hits to the device's day, week and month totals."""
+        for period in PERIODS:
+            key = period_key(period, date_str)
+            cur = conn.execute('''
+                UPDATE period_totals SET hit_count = hit_count + ?, firmware_version = ?
+                WHERE period = ? AND period_key = ? AND device_id = ?
+            ''', (added, firmware_version, period, key, device_id))
+            new_device = cur.rowcount == 0
+            if new_device:
+                conn.execute('''
+                    INSERT INTO period_totals (period, period_key, device_id, hit_count, firmware_version)
+                    VALUES (?, ?, ?, ?, ?)
+                ''', (period, key, device_id, added, firmware_version))
+            conn.execute('''
+                INSERT INTO period_summary (period, period_key, total_hits, active_devices) VALUES (?, ?, ?, ?)
+                ON CONFLICT(period, period_key) DO UPDATE SET
+                total_hits = total_hits + excluded.total_hits,
+                active_devices = active_devices + excluded.active_devices
+            ''', (period, key, added, int(new_device)))
+
+    @staticmethod
+    def _forget_period_totals(conn, device_id):
+        """Take a deleted device's hits back out of the period summaries."""
+        rows = conn.execute('SELECT period, period_key, hit_count FROM period_totals WHERE device_id = ?',
+                            (device_id,)).fetchall()
+        conn.executemany('''
+            UPDATE period_summary SET total_hits = total_hits - ?, active_devices = active_devices - 1
+            WHERE period = ? AND period_key = ?
+        ''', [(row['hit_count'], row['period'], row['period_key']) for row in rows])
+        conn.execute('DELETE FROM period_totals WHERE device_id = ?', (device_id,))
+
+    @staticmethod
+    def _create_period_tables(conn):
+        """Create the period tables in the main file, returns True if they are new."""
+        exists = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'period_summary'").fetchone()
+        conn.execute(PERIOD_TOTALS_SCHEMA)
+        conn.execute(PERIOD_TOTALS_INDEX)
+        conn.execute(PERIOD_SUMMARY_SCHEMA)
+        return exists is None
+
+    def rebuild_period_totals(self):
+        """Recompute the period tables from ``daily_stats`` (first start after upgrading, or repairs)."""
+        with self.read_connection() as conn:
+            conn.execute('DELETE FROM period_totals')
+            conn.execute('DELETE FROM period_summary')
+            for period, key_sql in PERIOD_KEY_SQL.items():
+                # A bare column next to MAX() comes from the max row: the device's latest firmware
+                conn.execute(f'''
+                    INSERT INTO period_totals (period, period_key, device_id, hit_count, firmware_version)
+                    SELECT ?, period_key, device_id, hit_count, firmware_version FROM (
+                        SELECT {key_sql} AS period_key, device_id, SUM(hit_count) AS hit_count,
+                               firmware_version, MAX(date)
+                        FROM daily_stats
+                        GROUP BY period_key, device_id
+                    )
+                ''', (period,))
+            conn.execute('''
+                INSERT INTO period_summary (period, period_key, total_hits, active_devices)
+                SELECT period, period_key, SUM(hit_count), COUNT(*)
+                FROM period_totals
+                GROUP BY period, period_key
+            ''')
+            conn.commit()
+
+    def delete_device(self, device_id):
+        raise NotImplementedError
+
+    def snapshot_into(self, target):
+        """Copy every table into ``target`` (an open connection), used by the read snapshot."""
+        raise NotImplementedError
+
+    def iter_daily_stats(self):
+        """Yield every raw ``daily_stats`` row, used by the migration tool."""
+        raise NotImplementedError
+
+    def bulk_load_daily_stats(self, rows):
+        """Insert raw rows as-is (no counter merging), used by migrations."""
+        raise NotImplementedError
+
+    # ---------- devices ----------
+
+    def device_exists(self, device_id):
+        conn = self.connect()
+        try:
+            row = conn.execute('SELECT device_id FROM devices WHERE device_id = ?', (device_id,)).fetchone()
+            return row is not None
+        finally:
+            conn.close()
+
+    def rename_device(self, device_id, device_name):
+        """Rename a device, returns False if it does not exist."""
+        conn = self.connect()
+        try:
+            cur = conn.execute('UPDATE devices SET device_name = ? WHERE device_id = ?', (device_name, device_id))
+            if cur.rowcount:
+                # Names appear in every report and in device filters
+                self._clear_report_cache(conn)
+            conn.commit()
+            return cur.rowcount > 0
+        finally:
+            conn.close()
+
+    # ---------- reads ----------
+
+    def fetch_dashboard_rows(self):
+        with self.read_connection() as conn:
+            return conn.execute('''
+                SELECT ds.device_id, ds.date, ds.hit_count, d.created_at, d.device_name, ds.firmware_version
+                FROM daily_stats ds
+                JOIN devices d ON ds.device_id = d.device_id
+                ORDER BY ds.firmware_version, ds.date DESC
+            ''').fetchall()
+
+    def fetch_firmware_summary(self, versions=None):
+        """Per-firmware aggregates: devices, date span, hits and device-days.
+
+        ``versions`` limits the result to the given firmware versions.
+        """
+        sql = '''
+            SELECT
+                firmware_version,
+                COUNT(DISTINCT device_id) AS device_count,
+                MIN(date) AS first_date,
+                MAX(date) AS last_date,
+                SUM(hit_count) AS total_hits,
+                COUNT(*) AS device_days
+            FROM daily_stats
+        '''
+        params = []
+        if versions:
+            sql += f" WHERE firmware_version IN ({','.join(['?'] * len(versions))})"
+            params.extend(versions)
+        sql += '''
+            GROUP BY firmware_version
+            ORDER BY firmware_version DESC
+        '''
+
+        with self.read_connection() as conn:
+            return conn.execute(sql, params).fetchall()
+
+    def fetch_firmware_upgrades(self, version_a, version_b, window_days):
+        """Same-device before/after hits per day for devices that upgraded from ``version_a`` to ``version_b``.
+
+        Compares each device's days on ``version_a`` in the ``window_days``
+        before its first day on ``version_b`` with its days on ``version_b``
+        in the ``window_days`` after it. The upgrade day itself is split
+        between versions and is left out.
+        """
+        sql = '''
+            WITH per_device AS (
+                SELECT
+                    device_id,
+                    date,
+                    firmware_version,
+                    hit_count,
+                    MIN(CASE WHEN firmware_version = :b THEN date END) OVER (PARTITION BY device_id) AS upgraded_on,
+                    MAX(CASE WHEN firmware_version = :a THEN date END) OVER (PARTITION BY device_id) AS last_on_a
+                FROM daily_stats
+                WHERE firmware_version IN (:a, :b)
+            ),
+            windowed AS (
+                SELECT device_id, upgraded_on, firmware_version, hit_count
+                FROM per_device
+                WHERE upgraded_on IS NOT NULL
+                  AND last_on_a <= upgraded_on
+                  AND (
+                      (firmware_version = :a AND date < upgraded_on AND date >= date(upgraded_on, :before))
+                      OR (firmware_version = :b AND date > upgraded_on AND date <= date(upgraded_on, :after))
+                  )
+            )
+            SELECT
+                w.device_id,
+                d.device_name,
+                w.upgraded_on,
+                AVG(CASE WHEN w.firmware_version = :a THEN w.hit_count END) AS before_hits_per_day,
+                AVG(CASE WHEN w.firmware_version = :b THEN w.hit_count END) AS after_hits_per_day,
+                COUNT(CASE WHEN w.firmware_version = :a THEN 1 END) AS before_days,
+                COUNT(CASE WHEN w.firmware_version = :b THEN 1 END) AS after_days
+            FROM windowed w
+            LEFT JOIN devices d ON w.device_id = d.device_id
+            GROUP BY w.device_id
+            HAVING before_days > 0 AND after_days > 0
+            ORDER BY w.upgraded_on, w.device_id
+        '''
+        params = {
+            'a': version_a,
+            'b': version_b,
+            'before': f'-{window_days} days',
+            'after': f'+{window_days} days',
+        }
+
+        with self.read_connection() as conn:
+            return conn.execute(sql, params).fetchall()
+
+    def fetch_daily_rows(self, report_date, device_names=None):
+        """Per-device rows of one day, ordered by hit_count DESC."""
+        sql = '''
+            SELECT
+                d.device_name,
+                ds.device_id,
+                ds.hit_count,
+                ds.firmware_version,
+                ds.created_at
+            FROM daily_stats ds
+            LEFT JOIN devices d ON ds.device_id = d.device_id
+            WHERE ds.date = ?
+        '''
+        params = [report_date]
+        sql, params = _filter_device_names(sql, params, device_names)
+        sql += ' ORDER BY ds.hit_count DESC'
+
+        with self.read_connection(report_date, report_date) as conn:
+            return conn.execute(sql, params).fetchall()
+
+    def fetch_period_rows(self, start_date, end_date, device_names=None, limit=None):
+        """Per-device aggregates over ``[start_date, end_date]``, ordered by total_hits DESC.
+
+        ``limit`` keeps only the top rows.
+        """
+        sql = '''
+            SELECT
+                d.device_name,
+                ds.device_id,
+                SUM(ds.hit_count) as total_hits,
+                COUNT(DISTINCT ds.date) as active_days,
+                MAX(ds.hit_count) as max_daily_hits,
+                ROUND(AVG(ds.hit_count), 0) as avg_daily_hits
+            FROM daily_stats ds
+            LEFT JOIN devices d ON ds.device_id = d.device_id
+            WHERE ds.date BETWEEN ? AND ?
+        '''
+        params = [start_date, end_date]
+        sql, params = _filter_device_names(sql, params, device_names)
+        sql += '''
+            GROUP BY ds.device_id
+            ORDER BY total_hits DESC
+        '''
+        if limit:
+            sql += ' LIMIT ?'
+            params.append(limit)
+
+        with self.read_connection(start_date, end_date) as conn:
+            return conn.execute(sql, params).fetchall()
+
+    def fetch_range_summary(self, start_date, end_date, device_names=None):
+        """Active devices and total hits over ``[start_date, end_date]``, for rolling-window reports."""
+        sql = '''
+            SELECT
+                COUNT(DISTINCT ds.device_id) AS active_devices,
+                COALESCE(SUM(ds.hit_count), 0) AS total_hits
+            FROM daily_stats ds
+            LEFT JOIN devices d ON ds.device_id = d.device_id
+            WHERE ds.date BETWEEN ? AND ?
+        '''
+        params = [start_date, end_date]
+        sql, params = _filter_device_names(sql, params, device_names)
+
+        with self.read_connection(start_date, end_date) as conn:
+            return conn.execute(sql, params).fetchone()
+
+    # ---------- period leaderboards ----------
+
+    def fetch_leaderboard(self, period, date_str, limit, device_names=None):
+        """Top ``limit`` devices of the calendar ``period`` containing ``date_str``, by hit_count DESC."""
+        sql = '''
+            SELECT
+                d.device_name,
+                pt.device_id,
+                pt.hit_count,
+                pt.firmware_version
+            FROM period_totals pt
+            LEFT JOIN devices d ON pt.device_id = d.device_id
+            WHERE pt.period = ? AND pt.period_key = ?
+        '''
+        params = [period, period_key(period, date_str)]
+        sql, params = _filter_device_names(sql, params, device_names)
+        sql += ' ORDER BY pt.hit_count DESC LIMIT ?'
+        params.append(limit)
+
+        # The period tables live in the main file; the narrow range keeps shard attaches to a minimum
+        key_date = period_bounds(period, date_str)[0]
+        with self.read_connection(key_date, key_date) as conn:
+            return conn.execute(sql, params).fetchall()
+
+    def fetch_period_summary(self, period, date_str, device_names=None):
+        """Active devices and total hits of the calendar ``period`` containing ``date_str``."""
+        key = period_key(period, date_str)
+        key_date = period_bounds(period, date_str)[0]
+        with self.read_connection(key_date, key_date) as conn:
+            if not device_names:
+                row = conn.execute('''
+                    SELECT active_devices, total_hits FROM period_summary
+                    WHERE period = ? AND period_key = ?
+                ''', (period, key)).fetchone()
+                if row is not None:
+                    return row
+            sql = '''
+                SELECT COUNT(*) AS active_devices, COALESCE(SUM(pt.hit_count), 0) AS total_hits
+                FROM period_totals pt
+                LEFT JOIN devices d ON pt.device_id = d.device_id
+                WHERE pt.period = ? AND pt.period_key = ?
+            '''
+            sql, params = _filter_device_names(sql, [period, key], device_names)
+            return conn.execute(sql, params).fetchone()
+
+    def fetch_range_rows(self, start_date, end_date, device_names=None):
+        """Raw per-device, per-day rows over ``[start_date, end_date]`` in one scan, ordered by date."""
+        sql = '''
+            SELECT
+                d.device_name,
+                ds.device_id,
+                ds.date,
+                ds.hit_count,
+                ds.firmware_version,
+                ds.created_at
+            FROM daily_stats ds
+            LEFT JOIN devices d ON ds.device_id = d.device_id
+            WHERE ds.date BETWEEN ? AND ?
+        '''
+        params = [start_date, end_date]
+        sql, params = _filter_device_names(sql, params, device_names)
+        sql += ' ORDER BY ds.date'
+
+        with self.read_connection(start_date, end_date) as conn:
+            return conn.execute(sql, params).fetchall()
+
+    # ---------- report archive ----------
+
+    def archive_reports(self, source, reports):
+        """Store rendered reports, replacing earlier runs of the same period.
+
+        ``reports`` is an iterable of ``(kind, period_start, period_end, content)``.
+        """
+        conn = self.connect()
+        try:
+            conn.execute(REPORT_ARCHIVE_SCHEMA)
+            conn.executemany('''
+                INSERT OR REPLACE INTO report_archive (source, kind, period_start, period_end, content)
+                VALUES (?, ?, ?, ?, ?)
+            ''', [(source, kind, start, end, content) for kind, start, end, content in reports])
+            conn.commit()
+        finally:
+            conn.close()
+
+    # ---------- report cache ----------
+
+    def cached_report(self, kind, start_date, end_date, device_names, compute):
+        """Return ``compute()`` for a report over ``[start_date, end_date]``, cached across runs.
+
+        ``kind`` names the report variant (include anything besides the range
+        and device filter that changes the result, e.g. the Top-N size).
+        ``compute`` must return JSON-serializable data, and comes back from
+        the cache with tuples turned into lists. An entry is reused until an
+        ingest stamps a date inside its range (see ``_stamp_date``).
+        """
+        device_filter = json.dumps(sorted(device_names or []), ensure_ascii=False)
+        key = (kind, start_date, end_date, device_filter)
+
+        conn = self.connect()
+        try:
+            conn.execute(CHANGE_STAMPS_SCHEMA)
+            conn.execute(REPORT_CACHE_SCHEMA)
+            # Read the stamps before computing: a write landing in between leaves a stale stamp_sum, never stale
+            # data, as long as writers make a date's rows visible no later than its stamp (see ShardedStorage._write)
+            stamp_sum = conn.execute('SELECT COALESCE(SUM(stamp), 0) FROM change_stamps WHERE date BETWEEN ? AND ?',
+                                     (start_date, end_date)).fetchone()[0]
+            row = conn.execute('''
+                SELECT stamp_sum, payload FROM report_cache
+                WHERE kind = ? AND start_date = ? AND end_date = ? AND device_filter = ?
+            ''', key).fetchone()
+            if row is not None and row['stamp_sum'] == stamp_sum:
+                return json.loads(row['payload'])
+
+            result = compute()
+            conn.execute('''
+                INSERT OR REPLACE INTO report_cache (kind, start_date, end_date, device_filter, stamp_sum, payload)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', key + (stamp_sum, json.dumps(result, ensure_ascii=False)))
+            conn.commit()
+            return result
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _clear_report_cache(conn):
+        conn.execute(REPORT_CACHE_SCHEMA)
+        conn.execute('DELETE FROM report_cache')
+
+    def count_daily_stats(self):
+        """(row count, hit_count sum), used to verify migrations."""
+        with self.read_connection() as conn:
+            row = conn.execute('SELECT COUNT(*), COALESCE(SUM(hit_count), 0) FROM daily_stats').fetchone()
+            return row[0], row[1]
+
+
+def _filter_device_names(sql, params, device_names):
+    if device_names:
+        placeholders = ','.join(['?'] * len(device_names))
+        sql += f' AND d.device_name IN ({placeholders})'
+        params = params + list(device_names)
+    return sql, params
+
+
+class SingleFileStorage(Storage):
+    """Original layout: one SQLite file holds every table."""
+
+    backend = 'single'
+
+    def init_schema(self):
+        conn = self.connect()
+        try:
+            conn.execute(DEVICES_SCHEMA)
+            conn.execute(DAILY_STATS_SCHEMA.format(
+                schema='', foreign_key='FOREIGN KEY (device_id) REFERENCES devices (device_id),\n        '))
+            conn.execute(DAILY_STATS_INDEX.format(schema=''))
+            conn.execute(DEVICE_COUNTERS_SCHEMA)
+            new_period_tables = self._create_period_tables(conn)
+            conn.execute(CHANGE_STAMPS_SCHEMA)
+            conn.execute(REPORT_CACHE_SCHEMA)
+            conn.commit()
+        finally:
+            conn.close()
+        if new_period_tables:
+            self.rebuild_period_totals()
+
+    @contextmanager
+    def read_connection(self, start_date=None, end_date=None):
+        conn = self.connect()
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def _write(self, ingests):
+        conn = self.connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            for ingest in ingests:
+                changes = self._merge_daily(lambda date_str: conn, ingest)
+                self._record_ingest(conn, lambda date_str: conn, ingest, changes)
+            conn.commit()
+        finally:
+            conn.close()
+
+    def delete_device(self, device_id):
+        conn = self.connect()
+        try:
+            if not conn.execute('SELECT device_id FROM devices WHERE device_id = ?', (device_id,)).fetchone():
+                return False
+            conn.execute('DELETE FROM daily_stats WHERE device_id = ?', (device_id,))
+            conn.execute('DELETE FROM device_counters WHERE device_id = ?', (device_id,))
+            self._forget_period_totals(conn, device_id)
+            self._clear_report_cache(conn)
+            conn.execute('DELETE FROM devices WHERE device_id = ?', (device_id,))
+            conn.commit()
+            return True
+        finally:
+            conn.close()
+
+    def snapshot_into(self, target):
+        conn = self.connect()
+        try:
+            conn.backup(target)
+        finally:
+            conn.close()
+
+    def iter_daily_stats(self):
+        conn = self.connect()
+        try:
+            yield from conn.execute(f'SELECT {DAILY_STATS_COLUMNS} FROM daily_stats ORDER BY date')
+        finally:
+            conn.close()
+
+    def bulk_load_daily_stats(self, rows):
+        conn = self.connect()
+        try:
+            conn.executemany(
+                f'INSERT INTO daily_stats ({DAILY_STATS_COLUMNS}) VALUES (?, ?, ?, ?, ?)',
+                (tuple(row) for row in rows))
+            conn.commit()
+        finally:
+            conn.close()
+
+
+class ShardedStorage(Storage):
+    """``daily_stats`` split into monthly files.
+
+    Each month lives in ``<shard_dir>/daily_stats_YYYY-MM.db`` and each
+    shard's index stays the size of one month. Range reads ATTACH only the
+    months they need. Writes open the month's shard file directly, so
+    ``daily_stats`` write locks are per month; the device registry, counter
+    state, period totals and change stamps stay in the main file and are
+    updated in a separate short transaction, which every write still takes.
+    """
+
+    backend = 'sharded'
+    SHARD_PATTERN = re.compile(r'^daily_stats_(\d{4}-\d{2})\.db$')
+
+    def __init__(self, db_path=DEFAULT_DB_PATH, shard_dir=None):
+        super().__init__(db_path)
+        self.shard_dir = shard_dir or os.path.join(os.path.dirname(db_path) or '.', 'shards')
+
+    def shard_path(self, month):
+        return os.path.join(self.shard_dir, f'daily_stats_{month}.db')
+
+    def shard_months(self):
+        """Months that currently have a shard file, oldest first."""
+        if not os.path.isdir(self.shard_dir):
+            return []
+        months = []
+        for name in os.listdir(self.shard_dir):
+            match = self.SHARD_PATTERN.match(name)
+            if match:
+                months.append(match.group(1))
+        return sorted(months)
+
+    def init_schema(self):
+        os.makedirs(self.shard_dir, exist_ok=True)
+        conn = self.connect()
+        try:
+            conn.execute(DEVICES_SCHEMA)
+            conn.execute(DEVICE_COUNTERS_SCHEMA)
+            new_period_tables = self._create_period_tables(conn)
+            conn.execute(CHANGE_STAMPS_SCHEMA)
+            conn.execute(REPORT_CACHE_SCHEMA)
+            conn.commit()
+        finally:
+            conn.close()
+        if new_period_tables:
+            self.rebuild_period_totals()
+
+    # ---------- ATTACH helpers ----------
+
+    @staticmethod
+    def _alias(month):
+        return 'm' + month.replace('-', '_')
+
+    @staticmethod
+    def _attach_limit(conn):
+        return conn.getlimit(sqlite3.SQLITE_LIMIT_ATTACHED)
+
+    def _attach(self, conn, months):
+        """ATTACH the given month shards, creating their tables if needed."""
+        aliases = []
+        for month in months:
+            alias = self._alias(month)
+            conn.execute('ATTACH DATABASE ? AS ' + alias, (self.shard_path(month),))
+            conn.execute(DAILY_STATS_SCHEMA.format(schema=alias + '.', foreign_key=''))
+            conn.execute(DAILY_STATS_INDEX.format(schema=alias + '.'))
+            aliases.append(alias)
+        conn.commit()
+        return aliases
+
+    @staticmethod
+    def _detach(conn, aliases):
+        for alias in aliases:
+            conn.execute('DETACH DATABASE ' + alias)
+
+    def _chunks(self, conn, months):
+        size = self._attach_limit(conn)
+        for i in range(0, len(months), size):
+            yield months[i:i + size]
+
+    def _months_in_range(self, start_date, end_date):
+        months = self.shard_months()
+        if start_date:
+            months = [m for m in months if m >= month_of(start_date)]
+        if end_date:
+            months = [m for m in months if m <= month_of(end_date)]
+        return months
+
+    # ---------- reads ----------
+
+    @contextmanager
+    def read_connection(self, start_date=None, end_date=None):
+        conn = self.connect()
+        try:
+            self._mount_daily_stats(conn, self._months_in_range(start_date, end_date))
+            yield conn
+        finally:
+            conn.close()
+
+    def _mount_daily_stats(self, conn, months):
+        """Expose the given shards as a TEMP ``daily_stats``.
+
+        Up to the ATTACH limit the shards stay attached behind a UNION ALL
+        view. Wider ranges are copied chunk by chunk into a TEMP table.
+        """
+        if months and len(months) <= self._attach_limit(conn):
+            aliases = self._attach(conn, months)
+            union = ' UNION ALL '.join(f'SELECT {DAILY_STATS_COLUMNS} FROM {alias}.daily_stats' for alias in aliases)
+            conn.execute(f'CREATE TEMP VIEW daily_stats AS {union}')
+            return
+
+        conn.execute(DAILY_STATS_SCHEMA.format(schema='temp.', foreign_key=''))
+        for chunk in self._chunks(conn, months):
+            aliases = self._attach(conn, chunk)
+            for alias in aliases:
+                conn.execute(f'INSERT INTO temp.daily_stats ({DAILY_STATS_COLUMNS}) '
+                             f'SELECT {DAILY_STATS_COLUMNS} FROM {alias}.daily_stats')
+            conn.commit()
+            self._detach(conn, aliases)
+
+    # ---------- writes ----------
+
+    def _shard_connect(self, month):
+        """Connection opened on one month's shard file itself, creating its table if needed."""
+        os.makedirs(self.shard_dir, exist_ok=True)
+        conn = sqlite3.connect(self.shard_path(month))
+        conn.row_factory = sqlite3.Row
+        conn.execute(DAILY_STATS_SCHEMA.format(schema='', foreign_key=''))
+        conn.execute(DAILY_STATS_INDEX.format(schema=''))
+        conn.commit()
+        return conn
+
+    def _write(self, ingests):
+        """Write the shards first, then the main file, each under its own lock.
+
+        The shards' write locks are taken up front (in month order, so two
+        writers cannot wait on each other); the main file is only locked for
+        its own bookkeeping. The shards commit before the main file, so a
+        reader never sees a date's new change stamp before its new rows and
+        ``cached_report`` can at worst store fresh data under an old stamp,
+        which the next run recomputes. The commits are not atomic: a main
+        commit failing after the shards' leaves period totals, stamps and
+        counter state behind ``daily_stats`` until ``rebuild_period_totals()``.
+        """
+        months = set()
+        for ingest in ingests:
+            dates = [ingest.date] if ingest.mode == 'counter' else ingest.daily_data
+            months.update(month_of(date_str) for date_str in dates)
+
+        shards = {}
+        conn = self.connect()
+        try:
+            for month in sorted(months):
+                shards[month] = self._shard_connect(month)
+                shards[month].execute('BEGIN IMMEDIATE')
+            daily_for = lambda date_str: shards[month_of(date_str)]
+
+            changes = [self._merge_daily(daily_for, ingest) for ingest in ingests]
+            conn.execute('BEGIN IMMEDIATE')
+            for ingest, ingest_changes in zip(ingests, changes):
+                self._record_ingest(conn, daily_for, ingest, ingest_changes)
+            for shard in shards.values():
+                shard.commit()
+            conn.commit()
+        finally:
+            # Closing without commit rolls back whatever is still open
+            for shard in shards.values():
+                shard.close()
+            conn.close()
+
+    def delete_device(self, device_id):
+        conn = self.connect()
+        try:
+            if not conn.execute('SELECT device_id FROM devices WHERE device_id = ?', (device_id,)).fetchone():
+                return False
+            for month in self.shard_months():
+                shard = self._shard_connect(month)
+                try:
+                    shard.execute('DELETE FROM daily_stats WHERE device_id = ?', (device_id,))
+                    shard.commit()
+                finally:
+                    shard.close()
+            conn.execute('DELETE FROM device_counters WHERE device_id = ?', (device_id,))
+            self._forget_period_totals(conn, device_id)
+            self._clear_report_cache(conn)
+            conn.execute('DELETE FROM devices WHERE device_id = ?', (device_id,))
+            conn.commit()
+            return True
+        finally:
+            conn.close()
+
+    def snapshot_into(self, target):
+        """Back up the main file, then merge every shard into one ``daily_stats`` table."""
+        conn = self.connect()
+        try:
+            conn.backup(target)
+        finally:
+            conn.close()
+
+        target.execute('DROP TABLE IF EXISTS daily_stats')
+        target.execute(DAILY_STATS_SCHEMA.format(schema='', foreign_key=''))
+        target.commit()
+        for chunk in self._chunks(target, self.shard_months()):
+            aliases = self._attach(target, chunk)
+            for alias in aliases:
+                target.execute(f'INSERT INTO main.daily_stats ({DAILY_STATS_COLUMNS}) '
+                               f'SELECT {DAILY_STATS_COLUMNS} FROM {alias}.daily_stats')
+            target.commit()
+            self._detach(target, aliases)
+        target.execute(DAILY_STATS_INDEX.format(schema=''))
+        target.commit()
+
+    def iter_daily_stats(self):
+        for month in self.shard_months():
+            conn = sqlite3.connect(self.shard_path(month))
+            try:
+                yield from conn.execute(f'SELECT {DAILY_STATS_COLUMNS} FROM daily_stats ORDER BY date')
+            finally:
+                conn.close()
+
+    def bulk_load_daily_stats(self, rows):
+        by_month = {}
+        for row in rows:
+            by_month.setdefault(month_of(row[1]), []).append(tuple(row))
+
+        for month in sorted(by_month):
+            shard = self._shard_connect(month)
+            try:
+                shard.executemany(
+                    f'INSERT INTO daily_stats ({DAILY_STATS_COLUMNS}) VALUES (?, ?, ?, ?, ?)',
+                    by_month[month])
+                shard.commit()
+            finally:
+                shard.close()
+
+
+def open_storage(db_path=None, backend=None):
+    """Build the configured backend.
+
+    ``db_path`` / ``backend`` default to the ``GOLF_DB_PATH`` and
+    ``GOLF_STORAGE_BACKEND`` environment variables, then to
+    ``data/golf_stats.db`` and ``single``.
+    """
+    db_path = db_path or os.environ.get('GOLF_DB_PATH', DEFAULT_DB_PATH)
+    backend = backend or os.environ.get('GOLF_STORAGE_BACKEND', 'single')
+    if backend == 'single':
+        return SingleFileStorage(db_path)
+    if backend == 'sharded':
+        return ShardedStorage(db_path)
+    raise ValueError(f'Unknown storage backend: {backend} (expected one of {", ".join(BACKENDS)})')
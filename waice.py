@@ -9,13 +9,21 @@ import sys
 from datetime import date, timedelta, datetime
 import argparse
 
+import backfill
+from storage import open_storage
+
 # ==================== 配置区 ====================
 DB_PATH = "/home/ubuntu/xxh/hitdata/data/golf_stats.db"
+# 存储布局: "single" (单文件) 或 "sharded" (按月分片), 需与 app.py 的 GOLF_STORAGE_BACKEND 一致
+STORAGE_BACKEND = os.environ.get("GOLF_STORAGE_BACKEND", "single")
 WECOM_WEBHOOK = "https://qyapi.weixin.qq.com/cgi-bin/webhook/send?key=6e79e27a-5e56-4300-b1d2-6bdaf392fd12"
 
 # 是否启用企业微信通知 (True=启用, False=禁用)
 ENABLE_WECOM_NOTIFY = True
 
+# 回填时连续发送企业微信消息的间隔 (秒)，机器人限制每分钟最多 20 条
+WECOM_SEND_INTERVAL_SECONDS = 3
+
 # 🎯【新增】关注设备列表
 # 如果列表不为空，报告将只包含这些设备的数据
 # 如果列表为空 []，则统计所有设备
@@ -26,6 +34,9 @@ TARGET_DEVICE_NAMES = [
     # "设备名B"
 ]
 
+# 报告中设备排行显示的数量: 关注列表模式通常设备不多，可以显示全部；否则限制前15
+TOP_N = 50 if TARGET_DEVICE_NAMES else 15
+
 # ==================== 辅助函数 ====================
 
 def send_wecom_markdown_v2(content: str):
@@ -59,18 +70,19 @@ def send_wecom_markdown_v2(content: str):
         print(f"警告: 解析企业微信响应失败, 响应内容: {response.text}")
 
 
-def get_db_connection():
-    """检查数据库文件并返回连接对象"""
+def get_storage():
+    """检查数据库文件并返回存储后端对象"""
     if not os.path.exists(DB_PATH):
         print(f"错误: 数据库文件不存在: {DB_PATH}")
         send_wecom_markdown_v2("❌ **数据库错误**\n> 数据库文件不存在，请检查路径配置。")
         sys.exit(1)
     
     try:
-        conn = sqlite3.connect(DB_PATH)
-        conn.row_factory = sqlite3.Row
-        return conn
-    except sqlite3.Error as e:
+        storage = open_storage(DB_PATH, STORAGE_BACKEND)
+        # 补建新版本增加的表（周期汇总、报告缓存等），升级后未重启 app.py 也能出报告
+        storage.init_schema()
+        return storage
+    except (sqlite3.Error, ValueError) as e:
         print(f"错误: 无法连接到数据库: {e}")
         send_wecom_markdown_v2(f"❌ **数据库错误**\n> 无法连接到数据库: {e}")
         sys.exit(1)
@@ -84,63 +96,21 @@ def get_display_name(device_name, device_id):
 
 # ==================== 报告生成函数 ====================
 
-def generate_daily_report(report_date_str: str):
-    """生成每日报告"""
-    print("==========================================")
-    print(f"生成每日高尔夫击球数统计报告")
-    print(f"日期: {report_date_str}")
-    if TARGET_DEVICE_NAMES:
-        print(f"过滤模式: 仅统计 {len(TARGET_DEVICE_NAMES)} 台关注设备")
-    print("==========================================")
-
-    conn = get_db_connection()
-    
-    # 基础查询
-    sql = """
-    SELECT 
-        d.device_name,
-        ds.device_id,
-        ds.hit_count,
-        ds.firmware_version,
-        ds.created_at
-    FROM daily_stats ds
-    LEFT JOIN devices d ON ds.device_id = d.device_id
-    WHERE ds.date = ?
-    """
-    
-    params = [report_date_str]
-
-    # 【修改】如果配置了关注列表，增加过滤条件
-    if TARGET_DEVICE_NAMES:
-        placeholders = ','.join(['?'] * len(TARGET_DEVICE_NAMES))
-        sql += f" AND d.device_name IN ({placeholders})"
-        params.extend(TARGET_DEVICE_NAMES)
-
-    sql += " ORDER BY ds.hit_count DESC;"
-    
-    try:
-        cursor = conn.cursor()
-        results = cursor.execute(sql, params).fetchall()
-    finally:
-        conn.close()
-
-    now_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+def build_daily_report(report_date_str: str, summary, results, now_time: str) -> str:
+    """构建每日报告的 Markdown 内容"""
     report_title_suffix = "(关注设备)" if TARGET_DEVICE_NAMES else ""
 
     if not results:
-        print("当日无目标设备击球数据")
-        message = (
+        return (
             f"## 📊 高尔夫击球数日报 {report_title_suffix}\n"
             f"**日期:** {report_date_str}\n"
             f"**状态:** 当日无目标设备活动记录\n\n"
             f"---\n"
             f"⏰ 报告时间: {now_time}"
         )
-        send_wecom_markdown_v2(message)
-        return
 
-    total_devices = len(results)
-    total_hits = sum(row['hit_count'] for row in results)
+    total_devices = summary['active_devices']
+    total_hits = summary['total_hits']
     top_device = results[0]
 
     report = [
@@ -157,87 +127,66 @@ def generate_daily_report(report_date_str: str):
         "| 排名 | 设备名称 | 击球数 | 固件版本 |",
         "|:----:|:--------|:------:|:----------|"
     ]
-    # 如果是关注列表模式，通常数量不多，可以显示全部；否则限制前15
-    limit = 50 if TARGET_DEVICE_NAMES else 15
-
-    for i, row in enumerate(results[:limit]):
+    for i, row in enumerate(results):
         rank = i + 1
         display_name = get_display_name(row['device_name'], row['device_id'])
         fw_version = row['firmware_version'] if row['firmware_version'] else "unknown"
         table.append(f"| {rank} | {display_name} | **{row['hit_count']}** | `{fw_version}` |")
 
     report.extend(table)
-    if total_devices > limit:
-        report.append(f"\n> ... 还有 {total_devices - limit} 台设备未显示")
+    if total_devices > TOP_N:
+        report.append(f"\n> ... 还有 {total_devices - TOP_N} 台设备未显示")
 
     report.append(f"\n---\n⏰ 报告生成时间: {now_time}")
     
-    final_report = "\n".join(report)
-    print(final_report)
-    send_wecom_markdown_v2(final_report)
+    return "\n".join(report)
 
 
-def generate_period_report(start_date_str: str, end_date_str: str, period_name: str, days: int):
-    """生成周期性报告 (周报/月报)"""
+def generate_daily_report(report_date_str: str):
+    """生成每日报告"""
     print("==========================================")
-    print(f"生成高尔夫击球数{period_name}报")
-    print(f"周期: {start_date_str} 至 {end_date_str}")
+    print(f"生成每日高尔夫击球数统计报告")
+    print(f"日期: {report_date_str}")
     if TARGET_DEVICE_NAMES:
         print(f"过滤模式: 仅统计 {len(TARGET_DEVICE_NAMES)} 台关注设备")
     print("==========================================")
 
-    conn = get_db_connection()
-    
-    # 基础查询
-    sql = """
-    SELECT 
-        d.device_name,
-        ds.device_id,
-        SUM(ds.hit_count) as total_hits,
-        COUNT(DISTINCT ds.date) as active_days,
-        MAX(ds.hit_count) as max_daily_hits,
-        ROUND(AVG(ds.hit_count), 0) as avg_daily_hits
-    FROM daily_stats ds
-    LEFT JOIN devices d ON ds.device_id = d.device_id
-    WHERE ds.date BETWEEN ? AND ?
-    """
-    
-    params = [start_date_str, end_date_str]
+    # 如果配置了关注列表，仅统计关注设备
+    # 汇总与排行直接读取入库时增量维护的当日统计，无需对全部设备排序；
+    # 结果按 (报告类型, 日期范围, 设备过滤) 缓存，当天有新数据写入时自动失效
+    storage = get_storage()
+    summary, results = storage.cached_report(
+        f"daily_top{TOP_N}", report_date_str, report_date_str, TARGET_DEVICE_NAMES,
+        lambda: (
+            dict(storage.fetch_period_summary('day', report_date_str, TARGET_DEVICE_NAMES)),
+            [dict(row) for row in storage.fetch_leaderboard('day', report_date_str, TOP_N, TARGET_DEVICE_NAMES)],
+        ))
 
-    # 【修改】如果配置了关注列表，增加过滤条件
-    if TARGET_DEVICE_NAMES:
-        placeholders = ','.join(['?'] * len(TARGET_DEVICE_NAMES))
-        sql += f" AND d.device_name IN ({placeholders})"
-        params.extend(TARGET_DEVICE_NAMES)
+    now_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    final_report = build_daily_report(report_date_str, summary, results, now_time)
 
-    sql += """
-    GROUP BY ds.device_id
-    ORDER BY total_hits DESC;
-    """
-    
-    try:
-        cursor = conn.cursor()
-        results = cursor.execute(sql, params).fetchall()
-    finally:
-        conn.close()
+    if not results:
+        print("当日无目标设备击球数据")
+    else:
+        print(final_report)
+    send_wecom_markdown_v2(final_report)
 
-    now_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+def build_period_report(start_date_str: str, end_date_str: str, period_name: str, days: int, summary, results, now_time: str) -> str:
+    """构建周期性报告 (周报/月报) 的 Markdown 内容"""
     report_title_suffix = "(关注设备)" if TARGET_DEVICE_NAMES else ""
 
     if not results:
-        print(f"本{period_name}无目标设备击球数据")
-        message = (
+        return (
             f"## 📊 高尔夫击球数{period_name}报 {report_title_suffix}\n"
             f"**周期:** `{start_date_str} ~ {end_date_str}`\n"
             f"**状态:** 本{period_name}无目标设备活动记录\n\n"
             f"---\n"
             f"⏰ 报告时间: {now_time}"
         )
-        send_wecom_markdown_v2(message)
-        return
 
-    total_devices = len(results)
-    total_hits = sum(row['total_hits'] for row in results)
+    total_devices = summary['active_devices']
+    total_hits = summary['total_hits']
     avg_daily_total = total_hits // days if days > 0 else 0
 
     report = [
@@ -255,25 +204,59 @@ def generate_period_report(start_date_str: str, end_date_str: str, period_name:
         "|:----:|:--------|:------:|:-----:|:----:|:------:|"
     ]
 
-    # 如果是关注列表模式，增加显示数量
-    limit = 50 if TARGET_DEVICE_NAMES else 15
-
-    for i, row in enumerate(results[:limit]):
+    for i, row in enumerate(results):
         rank = i + 1
         display_name = get_display_name(row['device_name'], row['device_id'])
         avg_daily_device = int(row['avg_daily_hits'])
         table.append(f"| {rank} | {display_name} | **{row['total_hits']}** | {row['active_days']} | {avg_daily_device} | {row['max_daily_hits']} |")
 
     report.extend(table)
-    if total_devices > limit:
-        report.append(f"\n> ... 还有 {total_devices - limit} 台设备未显示")
+    if total_devices > TOP_N:
+        report.append(f"\n> ... 还有 {total_devices - TOP_N} 台设备未显示")
         
     report.append(f"\n---\n⏰ 报告生成时间: {now_time}")
 
-    final_report = "\n".join(report)
-    print(final_report)
+    return "\n".join(report)
+
+
+def generate_period_report(start_date_str: str, end_date_str: str, period_name: str, days: int):
+    """生成周期性报告 (周报/月报)"""
+    print("==========================================")
+    print(f"生成高尔夫击球数{period_name}报")
+    print(f"周期: {start_date_str} 至 {end_date_str}")
+    if TARGET_DEVICE_NAMES:
+        print(f"过滤模式: 仅统计 {len(TARGET_DEVICE_NAMES)} 台关注设备")
+    print("==========================================")
+
+    # 如果配置了关注列表，仅统计关注设备
+    # 滚动周期不对齐自然周/月，由数据库聚合并只取前 TOP_N 名；
+    # 结果按 (报告类型, 日期范围, 设备过滤) 缓存，周期内有新数据写入时自动失效
+    storage = get_storage()
+    summary, results = storage.cached_report(
+        f"period_top{TOP_N}", start_date_str, end_date_str, TARGET_DEVICE_NAMES,
+        lambda: (
+            dict(storage.fetch_range_summary(start_date_str, end_date_str, TARGET_DEVICE_NAMES)),
+            [dict(row) for row in storage.fetch_period_rows(start_date_str, end_date_str, TARGET_DEVICE_NAMES, limit=TOP_N)],
+        ))
+
+    now_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    final_report = build_period_report(start_date_str, end_date_str, period_name, days, summary, results, now_time)
+
+    if not results:
+        print(f"本{period_name}无目标设备击球数据")
+    else:
+        print(final_report)
     send_wecom_markdown_v2(final_report)
 
+# ==================== 历史报告回填 ====================
+
+def run_backfill(start_date_str: str, end_date_str: str, kind: str, output_dir=None, archive=False, send=False, workers=None):
+    """回填 [开始, 结束] 内所有完整周期的报告，见 backfill.run_backfill"""
+    backfill.run_backfill(
+        get_storage(), "waice", build_daily_report, build_period_report, TOP_N,
+        start_date_str, end_date_str, kind, device_names=TARGET_DEVICE_NAMES, output_dir=output_dir, archive=archive,
+        send=send_wecom_markdown_v2 if send else None, send_interval=WECOM_SEND_INTERVAL_SECONDS, workers=workers)
+
 # ==================== 主程序入口 ====================
 
 def main():
@@ -302,6 +285,16 @@ def main():
     monthly_parser = subparsers.add_parser('monthly', help='生成最近30天月报')
     monthly_parser.add_argument('end_date', type=str, nargs='?', default=None, help='月报的结束日期 (可选, 格式: YYYY-MM-DD)')
 
+    # 批量回填历史报告
+    backfill_parser = subparsers.add_parser('backfill', help='批量回填历史报告 (一次扫描, 并行渲染)')
+    backfill_parser.add_argument('start_date', type=str, help='开始日期 (格式: YYYY-MM-DD)')
+    backfill_parser.add_argument('end_date', type=str, help='结束日期 (格式: YYYY-MM-DD)')
+    backfill_parser.add_argument('--kind', choices=list(backfill.PERIOD_DAYS), default='daily', help='报告类型 (默认: daily)')
+    backfill_parser.add_argument('--output-dir', type=str, default=None, help='将报告写入该目录 (每个周期一个 .md 文件)')
+    backfill_parser.add_argument('--archive', action='store_true', help='将报告写入数据库 report_archive 表')
+    backfill_parser.add_argument('--send', action='store_true', help='同时发送到企业微信')
+    backfill_parser.add_argument('--workers', type=int, default=None, help='渲染进程数 (默认: CPU 核数)')
+
     if len(sys.argv) == 1:
         sys.argv.append('yesterday')
         
@@ -325,6 +318,10 @@ def main():
         end_date = date.fromisoformat(args.end_date) if args.end_date else date.today() - timedelta(days=1)
         start_date = end_date - timedelta(days=29)
         generate_period_report(start_date.strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d'), "月", 30)
+    elif report_type == 'backfill':
+        if not (args.output_dir or args.archive or args.send):
+            parser.error("backfill 需要至少指定 --output-dir、--archive 或 --send 之一")
+        run_backfill(args.start_date, args.end_date, args.kind, args.output_dir, args.archive, args.send, args.workers)
 
     print("==========================================")
     print("报告生成完成")